@@ -0,0 +1,393 @@
+# bench_pdf_reader.py
+# Headless benchmarks of the hot paths of My Python PDF Viewer
+#
+# Copyright 2024, Dr. Eric O. Flores <eoftoro@gmail.com>
+#
+#
+# bench_pdf_reader.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# bench_pdf_reader.py is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with bench_pdf_reader.py.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Times the viewer's operations on synthetic documents under Qt's offscreen
+# platform:
+#
+#   python bench_pdf_reader.py --output results.json
+#   python bench_pdf_reader.py --baseline results.json --output new.json
+#
+# The documents (text-heavy, image-heavy, vector-heavy and a 10k-page one) are
+# generated with PyMuPDF into the work directory on the first run and reused
+# afterwards. Every operation runs --repeat times with cold caches; the median
+# time, the peak resident memory of the viewer process and the summed peaks of
+# its render worker processes are written as JSON.
+# With --baseline, operations slower than the baseline by more than
+# --tolerance are reported and the exit status is 1.
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import fitz  # PyMuPDF
+
+# Synthetic documents: name -> (pages, function drawing one page)
+LOREM = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut "
+         "labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco. ")
+
+
+def draw_text_page(page, page_number):
+    """Fill a page with small print."""
+    page.insert_textbox(fitz.Rect(36, 36, page.rect.width - 36, page.rect.height - 36),
+                        f"Page {page_number + 1}. " + LOREM * 40, fontsize=8)
+
+
+def draw_vector_page(page, page_number):
+    """Fill a page with a few thousand lines and curves."""
+    shape = page.new_shape()
+    for i in range(1500):
+        x = 36 + (i * 37) % 540
+        y = 36 + (i * 53) % 720
+        shape.draw_line((x, y), (x + 20, y + (i % 7) * 3))
+        shape.draw_bezier((x, y), (x + 10, y - 15), (x + 25, y + 15), (x + 30, y))
+    shape.finish(color=(0, 0, 0.6), width=0.3)
+    shape.commit()
+
+
+def draw_large_page(page, page_number):
+    """Put one line of text on a page."""
+    page.insert_text((72, 72), f"Page {page_number + 1}", fontsize=12)
+
+
+def write_document(path, pages, draw_page):
+    """Generate a document with a bookmark every 10 pages, so opening it has a table of contents."""
+    document = fitz.open()
+    for page_number in range(pages):
+        draw_page(document.new_page(), page_number)
+    document.set_toc([[1, f"Page {page_number + 1}", page_number + 1] for page_number in range(0, pages, 10)])
+    document.save(path, garbage=3, deflate=True)
+    document.close()
+
+
+def write_image_document(path, pages):
+    """Generate a scanned-looking document: every page is a 200 DPI image of a text page."""
+    source = fitz.open()
+    draw_text_page(source.new_page(), 0)
+    scan = source[0].get_pixmap(matrix=fitz.Matrix(200 / 72, 200 / 72), colorspace=fitz.csGRAY)
+    document = fitz.open()
+    for page_number in range(pages):
+        page = document.new_page()
+        page.insert_image(page.rect, pixmap=scan)
+    document.set_toc([[1, f"Page {page_number + 1}", page_number + 1] for page_number in range(0, pages, 10)])
+    document.save(path, garbage=3, deflate=True)
+    document.close()
+
+
+def generate_documents(directory, large_pages):
+    """Write the synthetic documents that are missing and return {name: path}."""
+    documents = {
+        'text': (200, lambda path: write_document(path, 200, draw_text_page)),
+        'image': (20, lambda path: write_image_document(path, 20)),
+        'vector': (50, lambda path: write_document(path, 50, draw_vector_page)),
+        'large': (large_pages, lambda path: write_document(path, large_pages, draw_large_page)),
+    }
+    paths = {}
+    for name, (pages, write) in documents.items():
+        path = os.path.join(directory, f"{name}-{pages}.pdf")
+        if not os.path.exists(path):
+            write(path)
+        paths[name] = path
+    return paths
+
+
+def reset_peak_rss(pids=()):
+    """Restart the peak resident memory measurement of this process and of pids, where the kernel allows it."""
+    for pid in ['self', *pids]:
+        try:
+            with open(f'/proc/{pid}/clear_refs', 'w') as clear_refs:
+                clear_refs.write('5')
+        except OSError:
+            pass
+
+
+def peak_rss_mb(pid='self'):
+    """Return the peak resident memory of a process in megabytes, this one by default.
+
+    Other processes can only be measured through /proc; 0 is returned for them elsewhere.
+    """
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid != 'self':
+        return 0.0
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Bench:
+    """Drives one PDFViewer window through the benchmarked operations."""
+
+    def __init__(self, args, paths):
+        # Qt is imported here so the spawned render workers, which import this
+        # module, stay as light as the viewer's own
+        from PyQt5.QtWidgets import QApplication, QMessageBox
+        from PyQt5.QtCore import QTimer
+        import pdf_reader
+        self.pdf_reader = pdf_reader
+        self.args = args
+        self.paths = paths
+        self.app = QApplication.instance() or QApplication([sys.argv[0]])
+        self.viewer = pdf_reader.PDFViewer()
+        self.viewer.resize(1000, 800)
+        self.viewer.show()
+        self.results = {}
+
+        # Completion messages would wait for a click; dismiss them as they appear
+        def dismiss_messages():
+            for widget in self.app.topLevelWidgets():
+                if isinstance(widget, QMessageBox) and widget.isVisible():
+                    widget.done(0)
+        self.message_timer = QTimer()
+        self.message_timer.timeout.connect(dismiss_messages)
+        self.message_timer.start(5)
+
+    def wait(self, predicate, timeout=None):
+        """Process events until predicate() holds; raises TimeoutError after timeout seconds."""
+        deadline = time.perf_counter() + (timeout or self.args.timeout)
+        while not predicate():
+            if time.perf_counter() > deadline:
+                raise TimeoutError("the operation did not finish in time")
+            self.app.processEvents()
+            time.sleep(0.001)
+
+    def visible_pages_shown(self):
+        """Whether every page in the viewport shows its sharp render."""
+        viewer = self.viewer
+        if not viewer.pdf_document or not viewer.page_offsets:
+            return False
+        first, last = viewer.visible_page_range()
+        return all(viewer.displayed_keys.get(page_number) == viewer.render_cache_key(page_number)
+                   for page_number in range(first, last + 1))
+
+    def jobs_done(self, kind=None):
+        """Whether the render scheduler has no queued or running job of a kind, or of any kind by default."""
+        scheduler = self.viewer.render_scheduler
+        return not any(kind is None or key[0] == kind for key in list(scheduler.pending_jobs) + list(scheduler.running))
+
+    def worker_pids(self):
+        """Return the process ids of the render scheduler's workers, none before its pool starts."""
+        # The pool's workers are the only processes the benchmark starts through multiprocessing
+        return [process.pid for process in multiprocessing.active_children()]
+
+    def cold_caches(self):
+        """Empty the render caches and the disk caches, so the next operation starts cold."""
+        # Background jobs such as the search index write to the disk caches
+        self.wait(self.jobs_done)
+        self.viewer.render_cache.clear()
+        self.viewer.tile_cache.clear()
+        shutil.rmtree(self.pdf_reader.pdf_engine.cache_directory(), ignore_errors=True)
+
+    def open(self, path):
+        """Open a document and wait until its first screen and side panels are ready."""
+        self.viewer.load_pdf(path)
+        self.wait(lambda: self.visible_pages_shown() and not self.viewer.document_panels_timer.isActive())
+
+    def close(self):
+        """Close every open document."""
+        while self.viewer.pdf_document:
+            self.viewer.close_pdf()
+
+    def measure(self, document, operation, setup, run):
+        """Time run() --repeat times on a document, calling setup() before each untimed."""
+        runs = []
+        peak = 0.0
+        worker_peak = 0.0  # Sum of the workers' peaks, which need not have coincided
+        for _ in range(self.args.repeat):
+            setup()
+            # Start with idle workers, so background work does not blur the timing
+            self.wait(self.jobs_done)
+            reset_peak_rss(self.worker_pids())
+            start = time.perf_counter()
+            run()
+            runs.append(time.perf_counter() - start)
+            peak = max(peak, peak_rss_mb())
+            # Workers started during the run are measured from their start
+            worker_peak = max(worker_peak, sum(peak_rss_mb(pid) for pid in self.worker_pids()))
+        self.results[f"{document}/{operation}"] = {
+            'seconds': statistics.median(runs),
+            'min_seconds': min(runs),
+            'runs': runs,
+            'peak_rss_mb': round(peak, 1),
+            'worker_peak_rss_mb': round(worker_peak, 1),
+        }
+        print(f"{document}/{operation}: {statistics.median(runs) * 1000:.1f} ms, peak RSS {peak:.0f} MB, "
+              f"workers {worker_peak:.0f} MB", file=sys.stderr)
+
+    def run(self, operations):
+        """Run the selected operations on every synthetic document."""
+        viewer = self.viewer
+        for document, path in self.paths.items():
+            def reopen():
+                self.close()
+                self.cold_caches()
+
+            def zoom_back():
+                if viewer.zoom_factor != 1.0:
+                    viewer.zoom_factor = 1.0
+                    viewer.display_all_pages()
+                self.cold_caches()
+
+            if 'load_pdf' in operations:
+                self.measure(document, 'load_pdf', reopen, lambda: self.open(path))
+            self.close()
+            self.open(path)
+            if 'display_all_pages' in operations:
+                self.measure(document, 'display_all_pages', self.cold_caches,
+                             lambda: (viewer.display_all_pages(), self.wait(self.visible_pages_shown)))
+            if 'render_page' in operations:
+                self.measure(document, 'render_page', self.cold_caches,
+                             lambda: viewer.render_page(viewer.current_page))
+            if 'load_thumbnails' in operations:
+                self.measure(document, 'load_thumbnails', self.cold_caches,
+                             lambda: (viewer.load_thumbnails(), self.app.processEvents(),
+                                      self.wait(lambda: self.jobs_done('thumbnail') and viewer.thumbnail_pages)))
+            if 'zoom' in operations:
+                self.measure(document, 'zoom', zoom_back,
+                             lambda: (viewer.zoom_in(), self.wait(self.visible_pages_shown)))
+                zoom_back()
+            if 'print' in operations:
+                self.measure(document, 'print', self.cold_caches, self.print_pages)
+            if 'ocr' in operations and document in ('text', 'image'):
+                if document == 'image' and not shutil.which('tesseract'):
+                    print("image/ocr: skipped, tesseract is not installed", file=sys.stderr)
+                else:
+                    self.measure(document, 'ocr', self.cold_caches, self.convert_to_odt)
+            self.close()
+
+    def print_pages(self):
+        """Print the first pages of the open document to a PDF file."""
+        from PyQt5.QtPrintSupport import QPrinter
+        viewer = self.viewer
+        printer = QPrinter(QPrinter.HighResolution)
+        printer.setOutputFormat(QPrinter.PdfFormat)
+        printer.setOutputFileName(os.path.join(self.args.work_dir, 'print.pdf'))
+        viewer.start_print_job(printer, list(range(min(self.args.print_pages, len(viewer.pdf_document)))))
+        self.wait(lambda: viewer.print_job is None)
+
+    def convert_to_odt(self):
+        """Convert the open document to an ODT file on the worker pool, as Convert to LibreOffice does."""
+        viewer = self.viewer
+        viewer.start_ocr_job(os.path.join(self.args.work_dir, 'ocr.odt'))
+        self.wait(lambda: not viewer.ocr_jobs)
+
+    def shutdown(self):
+        """Close the window and stop the worker processes."""
+        self.close()
+        self.message_timer.stop()
+        self.viewer.close()
+
+
+def compare(results, baseline, tolerance, min_seconds):
+    """Return the operations slower than in the baseline: [(name, baseline seconds, seconds)]."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['seconds'] > before['seconds'] * (1 + tolerance) and result['seconds'] - before['seconds'] > min_seconds:
+            regressions.append((name, before['seconds'], result['seconds']))
+    return regressions
+
+
+OPERATIONS = ('load_pdf', 'display_all_pages', 'render_page', 'load_thumbnails', 'zoom', 'print', 'ocr')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the PDF viewer on synthetic documents, headless.")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare against the results of an earlier run")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="slowdown over the baseline reported as a regression (default 0.25, i.e. 25%%)")
+    parser.add_argument('--min-difference', type=float, default=0.005,
+                        help="ignore slowdowns smaller than this many seconds (default 0.005)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs of each operation (default 3)")
+    parser.add_argument('--large-pages', type=int, default=10000, help="pages of the large document (default 10000)")
+    parser.add_argument('--print-pages', type=int, default=5, help="pages printed per run (default 5)")
+    parser.add_argument('--documents', default='text,image,vector,large',
+                        help="comma-separated documents to run on (default all)")
+    parser.add_argument('--operations', default=','.join(OPERATIONS),
+                        help="comma-separated operations to time (default all)")
+    parser.add_argument('--work-dir', help="where the documents are generated (default a temporary directory)")
+    parser.add_argument('--timeout', type=float, default=300, help="seconds an operation may take (default 300)")
+    return parser
+
+
+def main(argv=None):
+    """Run the benchmarks and return the process exit status."""
+    args = build_parser().parse_args(sys.argv[1:] if argv is None else argv)
+    args.work_dir = args.work_dir or os.path.join(tempfile.gettempdir(), 'mypdfviewer-bench')
+    os.makedirs(args.work_dir, exist_ok=True)
+    # Run offscreen, with caches of our own that every operation starts without
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    os.environ['XDG_CACHE_HOME'] = os.path.join(args.work_dir, 'cache')
+
+    paths = generate_documents(args.work_dir, args.large_pages)
+    names = [name for name in args.documents.split(',') if name]
+    unknown = [name for name in names if name not in paths] + \
+              [operation for operation in args.operations.split(',') if operation not in OPERATIONS]
+    if unknown:
+        print(f"Unknown documents or operations: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    bench = Bench(args, {name: paths[name] for name in names})
+    try:
+        bench.run(set(args.operations.split(',')))
+    finally:
+        bench.shutdown()
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pymupdf': fitz.VersionBind,
+        'cpus': os.cpu_count(),
+        'results': bench.results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compare(bench.results, baseline, args.tolerance, args.min_difference)
+        for name, before, after in regressions:
+            print(f"Regression: {name} {before * 1000:.1f} ms -> {after * 1000:.1f} ms "
+                  f"({after / before - 1:+.0%})", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
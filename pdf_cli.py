@@ -0,0 +1,335 @@
+# pdf_cli.py
+# Headless batch commands for My Python PDF Viewer
+#
+# Copyright 2024, Dr. Eric O. Flores <eoftoro@gmail.com>
+#
+#
+# pdf_cli.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdf_cli.py is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdf_cli.py.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Runs the viewer's document operations over many files without a display:
+#
+#   python pdf_reader.py split FILE... --spec "every 10" --output-dir DIR
+#   python pdf_reader.py merge FILE... --output OUT.pdf
+#   python pdf_reader.py rotate FILE... --angle 90 [--pages 1-3]
+#   python pdf_reader.py metadata FILE... --title T --author A
+#   python pdf_reader.py ocr FILE... --output-dir DIR
+#   python pdf_reader.py thumbnails FILE... --output-dir DIR
+#
+# Work is spread across a pool of worker processes. Progress is written to
+# stdout as one JSON object per line. PyQt is never imported.
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import fitz  # PyMuPDF
+import pdf_engine
+
+COMMANDS = ('split', 'merge', 'rotate', 'metadata', 'ocr', 'thumbnails')
+
+
+class Reporter:
+    """Writes progress events as JSON lines and keeps the totals of a command."""
+
+    def __init__(self, command, stream=None):
+        self.command = command
+        self.stream = stream or sys.stdout
+        self.started = time.perf_counter()
+        self.done = 0
+        self.failed = 0
+        self.total = 0
+
+    def emit(self, event, **fields):
+        """Write one event with the elapsed time of the command."""
+        record = {'event': event, 'command': self.command,
+                  'elapsed': round(time.perf_counter() - self.started, 4), **fields}
+        self.stream.write(json.dumps(record) + '\n')
+        self.stream.flush()
+
+    def start(self, total, **fields):
+        """Announce the number of jobs the command will run."""
+        self.total = total
+        self.emit('start', total=total, **fields)
+
+    def progress(self, seconds, **fields):
+        """Report a finished job and how long its worker took."""
+        self.done += 1
+        self.emit('progress', done=self.done, total=self.total, seconds=round(seconds, 4), **fields)
+
+    def error(self, message, **fields):
+        """Report a failed job."""
+        self.done += 1
+        self.failed += 1
+        self.emit('error', done=self.done, total=self.total, message=message, **fields)
+
+    def finish(self, **fields):
+        """Report the end of the command; returns the process exit status."""
+        self.emit('done', done=self.done, failed=self.failed, **fields)
+        return 1 if self.failed else 0
+
+
+def run_jobs(executor, reporter, jobs, on_result=None, on_error=None):
+    """Run (fields, function, args) jobs on the pool, reporting each as it finishes.
+
+    on_result(fields, result) is called on this process for every successful job
+    and may return extra fields for its progress event; on_error(fields) is called
+    for every job that failed.
+    """
+    futures = {executor.submit(pdf_engine.timed_job, function, *args): fields for fields, function, args in jobs}
+    for future in as_completed(futures):
+        fields = futures.pop(future)
+        try:
+            result, seconds = future.result()
+            extra = on_result(fields, result) if on_result else None
+        except Exception as e:
+            reporter.error(str(e), **fields)
+            if on_error:
+                on_error(fields)
+            continue
+        reporter.progress(seconds, **fields, **(extra or {}))
+
+
+def parse_pages(spec, path):
+    """0-based page numbers of a page range specification such as "1-3, 7-", or None for all pages."""
+    if not spec:
+        return None
+    with fitz.open(path) as document:
+        parts = pdf_engine.parse_page_spec(spec, len(document))
+    return sorted({page for first, last, _ in parts for page in range(first, last + 1)})
+
+
+def output_directory(args, path):
+    """Directory the outputs for path are written to, one subdirectory per input when there are several."""
+    directory = args.output_dir or os.path.dirname(os.path.abspath(path))
+    if args.output_dir and len(args.files) > 1:
+        directory = os.path.join(directory, os.path.splitext(os.path.basename(path))[0])
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def split_command(executor, reporter, args):
+    """Split every input according to --spec."""
+    jobs = []
+    for path in args.files:
+        with fitz.open(path) as document:
+            parts = pdf_engine.parse_page_spec(args.spec, len(document), document.get_toc(simple=True))
+        directory = output_directory(args, path)
+        parts = [(first, last, os.path.join(directory, pdf_engine.part_file_name(index, title)))
+                 for index, (first, last, title) in enumerate(parts)]
+        # Small parts are batched so each job carries enough pages to outweigh its round trip
+        batch = []
+        for part in parts:
+            batch.append(part)
+            if sum(last - first + 1 for first, last, _ in batch) >= args.batch_pages or part is parts[-1]:
+                jobs.append(({'file': path, 'parts': [output for _, _, output in batch]},
+                             pdf_engine.split_parts, (path, batch, pdf_engine.SAVE_PRESETS[args.preset])))
+                batch = []
+    reporter.start(len(jobs), files=len(args.files))
+    pages = []
+    run_jobs(executor, reporter, jobs, lambda fields, result: pages.append(result[1]) or {'pages': result[1]})
+    elapsed = time.perf_counter() - reporter.started
+    return reporter.finish(pages=sum(pages), pages_per_second=round(sum(pages) / max(elapsed, 1e-6), 1))
+
+
+def merge_command(executor, reporter, args):
+    """Merge all inputs into --output, one batch of files at a time."""
+    partial_path = args.output + '.partial'
+    save_options = pdf_engine.SAVE_PRESETS[args.preset]
+    batches = [args.files[first:first + args.batch_size] for first in range(0, len(args.files), args.batch_size)]
+    reporter.start(len(batches) + 1, files=len(args.files))
+    toc = []
+    try:
+        # Each batch appends to the partial output, so they run one after the other
+        for index, batch in enumerate(batches):
+            (pages, batch_toc), seconds = executor.submit(pdf_engine.timed_job, pdf_engine.append_merge_batch,
+                                                          partial_path, batch, index == 0, save_options).result()
+            toc.extend(batch_toc)
+            reporter.progress(seconds, files=len(batch), pages=pages)
+        pages, seconds = executor.submit(pdf_engine.timed_job, pdf_engine.finish_merge, partial_path, args.output, toc,
+                                         save_options).result()
+        reporter.progress(seconds, output=args.output, pages=pages)
+    except Exception as e:
+        reporter.error(str(e))
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return reporter.finish()
+
+
+def rotate_command(executor, reporter, args):
+    """Turn the pages of every input by --angle degrees."""
+    jobs = [({'file': path}, pdf_engine.rotate_document, (path, args.angle, parse_pages(args.pages, path)))
+            for path in args.files]
+    reporter.start(len(jobs))
+    run_jobs(executor, reporter, jobs, lambda fields, result: {'pages': result})
+    return reporter.finish()
+
+
+def metadata_command(executor, reporter, args):
+    """Set metadata fields of every input."""
+    fields = {name: getattr(args, name) for name in ('title', 'author', 'subject', 'keywords')
+              if getattr(args, name) is not None}
+    jobs = [({'file': path}, pdf_engine.update_metadata, (path, fields)) for path in args.files]
+    reporter.start(len(jobs))
+    run_jobs(executor, reporter, jobs, lambda fields, result: {'metadata': result})
+    return reporter.finish()
+
+
+def ocr_command(executor, reporter, args):
+    """Extract the text of every input into an .odt file, OCRing pages without a text layer."""
+    cache_dir = pdf_engine.cache_directory('ocr')
+    documents = {}  # Path -> state of its ODT output
+    jobs = []
+    for path in args.files:
+        with fitz.open(path) as document:
+            page_count = len(document)
+        output_path = os.path.join(output_directory(args, path), os.path.splitext(os.path.basename(path))[0] + '.odt')
+        if not page_count:
+            pdf_engine.OdtWriter(output_path).close()
+            continue
+        documents[path] = {'writer': None, 'output': output_path, 'page_count': page_count, 'next_page': 0,
+                           'texts': {}, 'failed': False}
+        jobs.extend(({'file': path, 'page': page_number}, pdf_engine.extract_page_text,
+                     (path, page_number, args.dpi, cache_dir)) for page_number in range(page_count))
+
+    def write_page(fields, result):
+        # Pages are written in order as soon as every earlier page is done
+        state = documents[fields['file']]
+        text, source = result
+        if state['failed']:
+            return {'source': source}
+        state['texts'][fields['page']] = text
+        while state['next_page'] in state['texts']:
+            if state['writer'] is None:
+                # Outputs are only opened once they have a page to write, so a long batch holds few files open
+                state['writer'] = pdf_engine.OdtWriter(state['output'])
+            state['writer'].add_paragraph(state['texts'].pop(state['next_page']))
+            state['next_page'] += 1
+        if state['next_page'] == state['page_count']:
+            state['writer'].close()
+            state['writer'] = None
+            return {'source': source, 'output': state['output']}
+        return {'source': source}
+
+    def drop_output(state):
+        # The output of a file with a failed page would be incomplete
+        state['failed'] = True
+        state['texts'].clear()
+        if state['writer'] is not None:
+            state['writer'].close()
+            state['writer'] = None
+        if os.path.exists(state['output']):
+            os.remove(state['output'])
+
+    reporter.start(len(jobs), files=len(args.files))
+    run_jobs(executor, reporter, jobs, write_page, lambda fields: drop_output(documents[fields['file']]))
+    for state in documents.values():
+        if state['next_page'] < state['page_count'] and not state['failed']:
+            drop_output(state)
+    return reporter.finish()
+
+
+def thumbnails_command(executor, reporter, args):
+    """Write a PNG thumbnail of the pages of every input."""
+    jobs = []
+    for path in args.files:
+        digest = pdf_engine.file_digest(path)
+        directory = output_directory(args, path)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        with fitz.open(path) as document:
+            rotations = [page.rotation for page in document]
+        pages = parse_pages(args.pages, path) or range(len(rotations))
+        jobs.extend(({'file': path, 'page': page_number,
+                      'output': os.path.join(directory, f"{stem}-{page_number + 1}.png")},
+                     pdf_engine.render_thumbnail, (path, page_number, args.zoom, rotations[page_number], digest))
+                    for page_number in pages)
+
+    def write_thumbnail(fields, png):
+        with open(fields['output'], 'wb') as png_file:
+            png_file.write(png)
+
+    reporter.start(len(jobs), files=len(args.files))
+    run_jobs(executor, reporter, jobs, write_thumbnail)
+    return reporter.finish()
+
+
+def build_parser():
+    """Return the argument parser of the batch commands."""
+    parser = argparse.ArgumentParser(prog='pdf_reader.py', description="Run PDF operations over many files without a display.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="worker processes (default: one per core)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    presets = sorted(pdf_engine.SAVE_PRESETS)
+
+    command = commands.add_parser('split', help="split files into parts")
+    command.add_argument('files', nargs='+')
+    command.add_argument('--spec', required=True, help='page ranges such as "1-3, 5-", "every N" or "bookmarks[:level]"')
+    command.add_argument('--output-dir', help="directory of the parts (default: next to each input)")
+    command.add_argument('--preset', choices=presets, default='fast', help="save options of the parts")
+    command.add_argument('--batch-pages', type=int, default=100, help="pages of small parts written per job")
+
+    command = commands.add_parser('merge', help="merge files into one")
+    command.add_argument('files', nargs='+')
+    command.add_argument('--output', required=True, help="merged PDF file")
+    command.add_argument('--preset', choices=presets, default='smallest', help="save options of the merged file")
+    command.add_argument('--batch-size', type=int, default=50, help="input files appended per batch")
+
+    command = commands.add_parser('rotate', help="rotate pages in place")
+    command.add_argument('files', nargs='+')
+    command.add_argument('--angle', type=int, choices=(90, 180, 270), default=90, help="degrees clockwise")
+    command.add_argument('--pages', help='page ranges such as "1-3, 7-" (default: all pages)')
+
+    command = commands.add_parser('metadata', help="set metadata fields in place")
+    command.add_argument('files', nargs='+')
+    for name in ('title', 'author', 'subject', 'keywords'):
+        command.add_argument(f'--{name}')
+
+    command = commands.add_parser('ocr', help="extract text to LibreOffice .odt files")
+    command.add_argument('files', nargs='+')
+    command.add_argument('--output-dir', help="directory of the .odt files (default: next to each input)")
+    command.add_argument('--dpi', type=int, default=300, help="resolution pages are OCR'd at")
+
+    command = commands.add_parser('thumbnails', help="export page thumbnails as PNG files")
+    command.add_argument('files', nargs='+')
+    command.add_argument('--output-dir', help="directory of the thumbnails (default: next to each input)")
+    command.add_argument('--zoom', type=float, default=0.2, help="zoom factor of the thumbnails")
+    command.add_argument('--pages', help='page ranges such as "1-3, 7-" (default: all pages)')
+    return parser
+
+
+def is_cli_command(argv):
+    """Whether the command line asks for a batch command rather than the viewer."""
+    return bool(argv) and (argv[0] in COMMANDS or argv[0] == '--workers')
+
+
+def main(argv=None):
+    """Run one batch command and return the process exit status."""
+    args = build_parser().parse_args(sys.argv[1:] if argv is None else argv)
+    # Spawned workers re-import the main module; point them at this Qt-free one
+    # instead of pdf_reader.py when the command was started from there
+    sys.modules['__main__'] = sys.modules[__name__]
+    reporter = Reporter(args.command)
+    command = globals()[f'{args.command}_command']
+    with ProcessPoolExecutor(max(1, args.workers), mp_context=multiprocessing.get_context('spawn')) as executor:
+        try:
+            return command(executor, reporter, args)
+        except (OSError, ValueError, RuntimeError) as e:
+            reporter.error(str(e))
+            return reporter.finish()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1115 @@
+# pdf_engine.py
+# Qt-free document helpers for My Python PDF Viewer
+#
+# Copyright 2024, Dr. Eric O. Flores <eoftoro@gmail.com>
+#
+#
+# pdf_engine.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdf_engine.py is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdf_engine.py.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Everything in this module runs without PyQt, so it can be executed inside
+# worker processes. Results are returned as plain Python values.
+
+
+import os
+import re
+import sys
+import bisect
+import json
+import math
+import hashlib
+import pickle
+import string
+import time
+import zipfile
+from contextlib import contextmanager
+from html import escape  # Lighter than xml.sax.saxutils, which pulls in urllib
+from array import array
+from collections import OrderedDict, deque
+import fitz  # PyMuPDF
+
+MAX_WORKER_DOCUMENTS = 8  # Document handles kept open by each worker process
+DIGEST_CHUNK = 1024 * 1024  # Bytes hashed from each end of a file to identify its content
+
+# Documents opened by this process, most recently used last: path -> (mtime, document)
+_worker_documents = OrderedDict()
+
+
+def run_job(function, *args):
+    """Call function(*args) in a worker, turning any error into one that survives pickling."""
+    try:
+        return function(*args)
+    except Exception as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+def timed_job(function, *args):
+    """Call function(*args) in a worker and return (result, seconds taken)."""
+    started = time.perf_counter()
+    result = run_job(function, *args)
+    return result, time.perf_counter() - started
+
+
+def open_worker_document(path):
+    """Return this process's handle on the document at path, reopening it if the file changed."""
+    mtime = os.stat(path).st_mtime_ns
+    entry = _worker_documents.get(path)
+    if entry is not None and entry[0] == mtime:
+        _worker_documents.move_to_end(path)
+        return entry[1]
+    if entry is not None:
+        entry[1].close()
+    document = fitz.open(path)
+    _worker_documents[path] = (mtime, document)
+    while len(_worker_documents) > MAX_WORKER_DOCUMENTS:
+        _, (_, old_document) = _worker_documents.popitem(last=False)
+        old_document.close()
+    return document
+
+
+def page_raster(page, zoom, clip=None):
+    """Rasterize a page and return (width, height, stride, components, samples)."""
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip)
+    return pix.width, pix.height, pix.stride, pix.n, pix.samples
+
+
+def rasterize_page(path, page_number, zoom, rotation=None, clip=None):
+    """Rasterize one page of the document at path; runs inside a worker process."""
+    page = open_worker_document(path).load_page(page_number)
+    if rotation is not None and page.rotation != rotation:
+        page.set_rotation(rotation)
+    return page_raster(page, zoom, clip)
+
+
+class OdtWriter:
+    """Writes an OpenDocument text file paragraph by paragraph, straight into its zip container.
+
+    Paragraphs are compressed into content.xml as they are added, so the text of a
+    whole document never has to be held in memory and no office suite is needed.
+    Every paragraph after the first starts on a new page.
+    """
+
+    MIMETYPE = 'application/vnd.oasis.opendocument.text'
+    MANIFEST = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">'
+                '<manifest:file-entry manifest:full-path="/" manifest:version="1.2" manifest:media-type="application/vnd.oasis.opendocument.text"/>'
+                '<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>'
+                '</manifest:manifest>')
+    CONTENT_START = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                     '<office:document-content xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+                     'xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0" '
+                     'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+                     'xmlns:fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0" office:version="1.2">'
+                     '<office:automatic-styles>'
+                     '<style:style style:name="PageStart" style:family="paragraph">'
+                     '<style:paragraph-properties fo:break-before="page"/></style:style>'
+                     '</office:automatic-styles><office:body><office:text>\n')
+    CONTENT_END = '</office:text></office:body></office:document-content>\n'
+    INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+    def __init__(self, path):
+        self.archive = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED)
+        # The mimetype must come first and be stored uncompressed
+        self.archive.writestr(zipfile.ZipInfo('mimetype'), self.MIMETYPE, compress_type=zipfile.ZIP_STORED)
+        self.archive.writestr('META-INF/manifest.xml', self.MANIFEST)
+        self.content = self.archive.open('content.xml', 'w', force_zip64=True)
+        self.content.write(self.CONTENT_START.encode('utf-8'))
+        self.paragraphs = 0
+
+    def add_paragraph(self, text):
+        """Append one paragraph; line breaks and tabs in text are kept."""
+        text = escape(self.INVALID_XML.sub('', text.strip('\n\f')), quote=False)
+        text = text.replace('\t', '<text:tab/>').replace('\n', '<text:line-break/>')
+        style = ' text:style-name="PageStart"' if self.paragraphs else ''
+        self.content.write(f'<text:p{style}>{text}</text:p>\n'.encode('utf-8'))
+        self.paragraphs += 1
+
+    def close(self):
+        """Finish content.xml and the zip container."""
+        if self.content is not None:
+            self.content.write(self.CONTENT_END.encode('utf-8'))
+            self.content.close()
+            self.content = None
+            self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def cache_directory(*parts):
+    """Return (and create) a directory under the viewer's XDG cache directory."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    directory = os.path.join(base, 'mypdfviewer', *parts)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def file_digest(path):
+    """Return a digest identifying the content of a file.
+
+    Only the size and the first and last DIGEST_CHUNK bytes are hashed, which is
+    enough to tell PDF files apart (incremental saves append to the end) without
+    reading gigabytes on every open.
+    """
+    digest = hashlib.sha256()
+    size = os.path.getsize(path)
+    digest.update(str(size).encode())
+    with open(path, 'rb') as pdf_file:
+        digest.update(pdf_file.read(DIGEST_CHUNK))
+        if size > DIGEST_CHUNK:
+            pdf_file.seek(max(DIGEST_CHUNK, size - DIGEST_CHUNK))
+            digest.update(pdf_file.read(DIGEST_CHUNK))
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """Files in a cache directory, evicted least recently used first against a size budget.
+
+    Reading a file refreshes its modification time, which is what eviction goes by.
+    """
+
+    EVICT_EVERY = 64  # Writes between two eviction passes
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.writes = 0
+
+    def file_path(self, name):
+        """Return the path of a cached file, spread over subdirectories."""
+        return os.path.join(self.directory, name[:2], name)
+
+    def read(self, name):
+        """Return the content of a cached file, or None."""
+        path = self.file_path(name)
+        try:
+            with open(path, 'rb') as cache_file:
+                data = cache_file.read()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def write(self, name, data):
+        """Store a file atomically, evicting old files now and then."""
+        path = self.file_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as cache_file:
+            cache_file.write(data)
+        os.replace(temp_path, path)
+        self.writes += 1
+        if self.writes % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used files until the cache fits its budget."""
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                files.append((info.st_mtime, info.st_size, path))
+                total += info.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+class ThumbnailCache(DiskCache):
+    """PNG thumbnails on disk, keyed by document digest, page, zoom and rotation."""
+
+    def __init__(self, directory=None, max_bytes=256 * 1024 * 1024):
+        super().__init__(directory or cache_directory('thumbnails'), max_bytes)
+
+    def get(self, digest, page_number, zoom, rotation):
+        """Return the PNG bytes of a cached thumbnail, or None."""
+        return self.read(f"{digest}-{page_number}-{zoom:g}-{rotation}.png")
+
+    def put(self, digest, page_number, zoom, rotation, png):
+        """Store the PNG bytes of a thumbnail."""
+        self.write(f"{digest}-{page_number}-{zoom:g}-{rotation}.png", png)
+
+
+class OcrCache(DiskCache):
+    """OCR output on disk, keyed by a hash of the page image and the OCR settings."""
+
+    def __init__(self, directory=None, max_bytes=64 * 1024 * 1024):
+        super().__init__(directory or cache_directory('ocr'), max_bytes)
+
+    @staticmethod
+    def name(pix, settings):
+        """Return the cache file name of a rendered page under the given settings."""
+        digest = hashlib.sha256(f"{pix.width}x{pix.height}x{pix.n}:{settings}".encode())
+        digest.update(pix.samples)
+        return f"{digest.hexdigest()}.txt"
+
+    def get(self, pix, settings):
+        """Return the cached text of a rendered page, or None."""
+        data = self.read(self.name(pix, settings))
+        return None if data is None else data.decode('utf-8')
+
+    def put(self, pix, settings, text):
+        """Store the text recognized on a rendered page."""
+        self.write(self.name(pix, settings), text.encode('utf-8'))
+
+
+class RepairCache(DiskCache):
+    """Repaired copies of damaged PDF files, keyed by the digest of the damaged file."""
+
+    def __init__(self, directory=None, max_bytes=4 * 1024 * 1024 * 1024):
+        super().__init__(directory or cache_directory('repaired'), max_bytes)
+
+    def get(self, digest):
+        """Return the path of the repaired copy of a file, or None."""
+        path = self.file_path(f"{digest}.pdf")
+        try:
+            os.utime(path)
+            return path
+        except OSError:
+            return None
+
+    def put(self, digest, document):
+        """Save a repaired document as the copy of the file with the given digest and return its path."""
+        # Old copies go first, so the new one is never evicted before it is opened
+        self.evict()
+        path = self.file_path(f"{digest}.pdf")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        document.save(temp_path, garbage=1)
+        os.replace(temp_path, path)
+        return path
+
+
+def prepare_document(path, cache_dir=None):
+    """Open a document in a worker and return (path the viewer should open, whether it was repaired).
+
+    MuPDF repairs damaged files while opening them, which can take long on large
+    files. The repaired document is saved once to a copy in the repair cache and
+    the copy is what the viewer opens, now and on later opens of the same file.
+    """
+    cache = RepairCache(cache_dir)
+    digest = file_digest(path)
+    repaired_path = cache.get(digest)
+    if repaired_path is not None:
+        return repaired_path, True
+    document = fitz.open(path)
+    try:
+        if not document.is_repaired:
+            return path, False
+        return cache.put(digest, document), True
+    finally:
+        document.close()
+
+
+_thumbnail_caches = {}  # Directory -> ThumbnailCache used by this worker process
+
+
+def render_thumbnail(path, page_number, zoom, rotation, digest, cache_dir=None):
+    """Return the PNG bytes of a page thumbnail, from the disk cache or freshly rendered."""
+    cache = _thumbnail_caches.get(cache_dir)
+    if cache is None:
+        cache = _thumbnail_caches[cache_dir] = ThumbnailCache(cache_dir)
+    png = cache.get(digest, page_number, zoom, rotation) if digest else None
+    if png is None:
+        page = open_worker_document(path).load_page(page_number)
+        if page.rotation != rotation:
+            page.set_rotation(rotation)
+        png = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom)).tobytes('png')
+        if digest:
+            cache.put(digest, page_number, zoom, rotation, png)
+    return png
+
+
+def ocr_pixmap(pix):
+    """Run tesseract on a rendered page and return the recognized text."""
+    import pytesseract  # Loaded on first use, most sessions never run OCR
+    from PIL import Image
+    image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    return pytesseract.image_to_string(image)
+
+
+MIN_TEXT_LAYER_CHARS = 32  # Pages with images and less text than this are OCR'd
+
+
+def page_text(page, dpi, cache=None):
+    """Return (text, source) for a page, source being 'text', 'cache' or 'ocr'.
+
+    Born-digital pages are read from their text layer. Only pages that have images
+    and next to no extractable text are rendered and OCR'd, and the recognized text
+    is cached by page image and settings.
+    """
+    text = page.get_text()
+    if len(text.strip()) >= MIN_TEXT_LAYER_CHARS or not page.get_images():
+        return text, 'text'
+    pix = page.get_pixmap(dpi=dpi, alpha=False)
+    settings = f"dpi={dpi}"
+    if cache is not None:
+        cached = cache.get(pix, settings)
+        if cached is not None:
+            return cached, 'cache'
+    text = ocr_pixmap(pix)
+    if cache is not None:
+        cache.put(pix, settings, text)
+    return text, 'ocr'
+
+
+_ocr_caches = {}  # Directory -> OcrCache used by this worker process
+
+
+def extract_page_text(path, page_number, dpi, cache_dir=None):
+    """Extract the text of one page, OCRing it only when needed; runs inside a worker process."""
+    # The pool already runs one page per core, so keep tesseract single-threaded
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+    cache = _ocr_caches.get(cache_dir)
+    if cache is None:
+        cache = _ocr_caches[cache_dir] = OcrCache(cache_dir)
+    return page_text(open_worker_document(path).load_page(page_number), dpi, cache)
+
+
+def normalize_word(word, case_sensitive=False):
+    """Strip surrounding punctuation from a word and fold its case unless asked not to."""
+    word = word.strip(string.punctuation + '\u201c\u201d\u2018\u2019')
+    return word if case_sensitive else word.casefold()
+
+
+class SearchIndex:
+    """Inverted index of the words of a document, with the rectangle of every word.
+
+    Each page keeps its words in reading order and their rectangles in unrotated
+    page coordinates, packed four floats per word. The postings map every
+    case-folded word to the pages and word positions where it occurs, packed as
+    page << 32 | position, so single words and phrases are found without touching
+    the document again.
+    """
+
+    FORMAT = 1  # Bumped whenever the on-disk layout changes
+
+    def __init__(self):
+        self.page_words = []  # Per page, the words as extracted
+        self.page_rects = []  # Per page, array('f') of x0, y0, x1, y1 per word
+        self.postings = {}  # Case-folded word -> array('Q') of page << 32 | position
+
+    def add_page(self, words):
+        """Index the next page from MuPDF's (x0, y0, x1, y1, word, ...) word tuples."""
+        page_number = len(self.page_words)
+        texts = []
+        rects = array('f')
+        for position, word in enumerate(words):
+            texts.append(word[4])
+            rects.extend(word[:4])
+            term = normalize_word(word[4])
+            if term:
+                postings = self.postings.get(term)
+                if postings is None:
+                    postings = self.postings[term] = array('Q')
+                postings.append(page_number << 32 | position)
+        self.page_words.append(texts)
+        self.page_rects.append(rects)
+
+    def extend(self, other):
+        """Append the pages of an index built from the pages that follow this one's."""
+        offset = len(self.page_words) << 32
+        self.page_words.extend(other.page_words)
+        self.page_rects.extend(other.page_rects)
+        for term, postings in other.postings.items():
+            merged = self.postings.get(term)
+            if merged is None:
+                merged = self.postings[term] = array('Q')
+            merged.extend(packed + offset for packed in postings)
+
+    def word_rect(self, page_number, position):
+        """Return the rectangle of one word as an (x0, y0, x1, y1) tuple."""
+        rects = self.page_rects[page_number]
+        return tuple(rects[position * 4:position * 4 + 4])
+
+    def search(self, query, case_sensitive=False):
+        """Return the hits of a word or phrase as (page number, [word rectangles]) in document order."""
+        terms = [normalize_word(word, case_sensitive) for word in query.split()]
+        terms = [term for term in terms if term]
+        if not terms:
+            return []
+        postings = self.postings.get(terms[0].casefold() if case_sensitive else terms[0])
+        if postings is None:
+            return []
+
+        hits = []
+        for packed in postings:
+            page_number, position = packed >> 32, packed & 0xFFFFFFFF
+            words = self.page_words[page_number]
+            if position + len(terms) > len(words):
+                continue
+            if all(normalize_word(words[position + offset], case_sensitive) == term
+                   for offset, term in enumerate(terms)):
+                hits.append((page_number, [self.word_rect(page_number, position + offset)
+                                           for offset in range(len(terms))]))
+        return hits
+
+    def save(self, path):
+        """Write the index to a file, atomically."""
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as index_file:
+            pickle.dump((self.FORMAT, self.page_words, self.page_rects, self.postings), index_file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save, or return None if it is missing or outdated."""
+        try:
+            with open(path, 'rb') as index_file:
+                data = pickle.load(index_file)
+        except (OSError, pickle.PickleError, EOFError, ValueError):
+            return None
+        if not isinstance(data, tuple) or data[0] != cls.FORMAT:
+            return None
+        index = cls()
+        _, index.page_words, index.page_rects, index.postings = data
+        return index
+
+
+def search_pages(path, query, case_sensitive, first_page, last_page):
+    """Scan a range of pages for a word or phrase without an index; runs inside a worker process."""
+    document = open_worker_document(path)
+    hits = []
+    for page_number in range(first_page, last_page + 1):
+        index = SearchIndex()
+        index.add_page(document.load_page(page_number).get_text('words'))
+        hits.extend((page_number, rects) for _, rects in index.search(query, case_sensitive))
+    return hits
+
+
+def search_index_path(digest, cache_dir=None):
+    """Return the file caching the search index of a document."""
+    return os.path.join(cache_dir or cache_directory('search'), f"{digest}.idx")
+
+
+def load_search_index(digest, cache_dir=None):
+    """Return the cached search index of a document, or None if it has to be built."""
+    return SearchIndex.load(search_index_path(digest, cache_dir)) if digest else None
+
+
+def index_pages(path, first_page, last_page):
+    """Index a range of pages, for SearchIndex.extend to append in page order; runs inside a worker process.
+
+    Large documents are indexed in chunks, so the jobs of the pages on screen
+    never wait behind the whole document.
+    """
+    index = SearchIndex()
+    document = open_worker_document(path)
+    for page_number in range(first_page, last_page + 1):
+        index.add_page(document.load_page(page_number).get_text('words'))
+    return index
+
+
+class AnnotationStore:
+    """The viewer annotations of a document, in unrotated page coordinates.
+
+    Annotations are kept in parallel array columns indexed by annotation id (page,
+    kind, alive flag and x0, y0, x1, y1 packed four floats each), with the text of
+    notes in a side dictionary, so tens of thousands of them cost a few bytes each.
+    Every page has a grid of CELL-point cells listing the ids whose rectangle
+    touches each cell, so the annotations in a region or under a point are found
+    without scanning the page.
+    """
+
+    KINDS = ('highlight', 'rectangle', 'text_note')
+    CELL = 64.0  # Edge of the spatial index cells, in points
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Remove every annotation."""
+        self.pages = array('I')  # Page number per id
+        self.kinds = array('B')  # Index in KINDS per id
+        self.alive = array('B')  # 0 once an id has been removed
+        self.rects = array('f')  # x0, y0, x1, y1 per id
+        self.texts = {}  # Id -> text of the notes
+        self.grids = {}  # Page number -> {(column, row): array('I') of ids}
+        self.page_counts = {}  # Page number -> annotations alive on the page
+
+    def __len__(self):
+        return sum(self.page_counts.values())
+
+    def cells(self, rect):
+        """Yield the grid cells covered by an (x0, y0, x1, y1) rectangle."""
+        x0, y0, x1, y1 = rect
+        for row in range(int(y0 // self.CELL), int(y1 // self.CELL) + 1):
+            for column in range(int(x0 // self.CELL), int(x1 // self.CELL) + 1):
+                yield column, row
+
+    def add(self, page_number, kind, rect, text=None):
+        """Store an annotation of the given kind covering rect on a page and return its id."""
+        x0, y0, x1, y1 = rect
+        rect = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        annotation_id = len(self.pages)
+        self.pages.append(page_number)
+        self.kinds.append(self.KINDS.index(kind))
+        self.alive.append(1)
+        self.rects.extend(rect)
+        if text is not None:
+            self.texts[annotation_id] = text
+        grid = self.grids.setdefault(page_number, {})
+        for cell in self.cells(rect):
+            ids = grid.get(cell)
+            if ids is None:
+                ids = grid[cell] = array('I')
+            ids.append(annotation_id)
+        self.page_counts[page_number] = self.page_counts.get(page_number, 0) + 1
+        return annotation_id
+
+    def remove(self, annotation_id):
+        """Remove an annotation; its id is not reused, and restore brings it back."""
+        if not self.alive[annotation_id]:
+            return
+        self.alive[annotation_id] = 0
+        page_number = self.pages[annotation_id]
+        grid = self.grids[page_number]
+        for cell in self.cells(self.rect(annotation_id)):
+            ids = grid[cell]
+            ids.remove(annotation_id)
+            if not ids:
+                del grid[cell]
+        self.page_counts[page_number] -= 1
+        if not self.page_counts[page_number]:
+            del self.page_counts[page_number]
+            del self.grids[page_number]
+
+    def restore(self, annotation_id):
+        """Bring back a removed annotation under its old id."""
+        if self.alive[annotation_id]:
+            return
+        self.alive[annotation_id] = 1
+        page_number = self.pages[annotation_id]
+        grid = self.grids.setdefault(page_number, {})
+        for cell in self.cells(self.rect(annotation_id)):
+            ids = grid.get(cell)
+            if ids is None:
+                ids = grid[cell] = array('I')
+            # Keep the cell in id order, so drawing order survives undo
+            bisect.insort(ids, annotation_id)
+        self.page_counts[page_number] = self.page_counts.get(page_number, 0) + 1
+
+    def rect(self, annotation_id):
+        """Return the rectangle of an annotation as an (x0, y0, x1, y1) tuple."""
+        return tuple(self.rects[annotation_id * 4:annotation_id * 4 + 4])
+
+    def get(self, annotation_id):
+        """Return (page number, kind, rect, text) of an annotation; text is None except for notes."""
+        return (self.pages[annotation_id], self.KINDS[self.kinds[annotation_id]],
+                self.rect(annotation_id), self.texts.get(annotation_id))
+
+    def annotated_pages(self):
+        """Return the numbers of the pages that have annotations, in order."""
+        return sorted(self.page_counts)
+
+    def query(self, page_number, rect=None):
+        """Return the ids of the annotations on a page that intersect rect (all by default), oldest first."""
+        grid = self.grids.get(page_number)
+        if not grid:
+            return []
+        if rect is None:
+            found = {annotation_id for ids in grid.values() for annotation_id in ids}
+            return sorted(found)
+        x0, y0, x1, y1 = rect
+        found = set()
+        for cell in self.cells(rect):
+            ids = grid.get(cell)
+            if ids is not None:
+                found.update(ids)
+        rects = self.rects
+        return sorted(annotation_id for annotation_id in found
+                      if rects[annotation_id * 4] <= x1 and rects[annotation_id * 4 + 2] >= x0
+                      and rects[annotation_id * 4 + 1] <= y1 and rects[annotation_id * 4 + 3] >= y0)
+
+    def hit_test(self, page_number, x, y, tolerance=0.0):
+        """Return the id of the topmost annotation within tolerance of a point on a page, or None."""
+        hits = self.query(page_number, (x - tolerance, y - tolerance, x + tolerance, y + tolerance))
+        return hits[-1] if hits else None
+
+
+def write_annotations(store, path):
+    """Write the annotations of store to a JSON Lines file, one annotation per line; returns the count.
+
+    Each line is {"page": n, "type": kind, "rect": [x0, y0, x1, y1]} in unrotated
+    page coordinates, plus "text" for notes.
+    """
+    count = 0
+    with open(path, 'w', encoding='utf-8') as jsonl_file:
+        for page_number in store.annotated_pages():
+            for annotation_id in store.query(page_number):
+                _, kind, rect, text = store.get(annotation_id)
+                record = {'page': page_number, 'type': kind, 'rect': [round(value, 2) for value in rect]}
+                if text is not None:
+                    record['text'] = text
+                jsonl_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                count += 1
+    return count
+
+
+def read_annotations(store, path, document):
+    """Add the annotations of a JSON Lines file written by write_annotations to store; returns the count.
+
+    The file is read line by line and nothing is added unless every line is valid;
+    ValueError names the first line that is not. Rectangles are clipped to their
+    page of document, and ones that lie entirely off the page are invalid.
+    """
+    page_bounds = {}  # Page number -> unrotated (x0, y0, x1, y1) of the pages read so far
+    records = []
+    with open(path, encoding='utf-8') as jsonl_file:
+        for line_number, line in enumerate(jsonl_file, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                page_number, kind, rect = record['page'], record['type'], record['rect']
+                if (not isinstance(page_number, int) or isinstance(page_number, bool)
+                        or not 0 <= page_number < len(document)):
+                    raise ValueError
+                if (kind not in AnnotationStore.KINDS or not isinstance(rect, (list, tuple)) or len(rect) != 4
+                        or not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in rect)):
+                    raise ValueError
+                rect = tuple(map(float, rect))
+                if not all(map(math.isfinite, rect)):
+                    raise ValueError
+                text = record.get('text')
+                if kind == 'text_note' and not isinstance(text, str):
+                    raise ValueError
+                bounds = page_bounds.get(page_number)
+                if bounds is None:
+                    cropbox = document.load_page(page_number).cropbox
+                    bounds = page_bounds[page_number] = (0.0, 0.0, cropbox.width, cropbox.height)
+                x0, y0, x1, y1 = min(rect[0], rect[2]), min(rect[1], rect[3]), max(rect[0], rect[2]), max(rect[1], rect[3])
+                if x0 > bounds[2] or y0 > bounds[3] or x1 < bounds[0] or y1 < bounds[1]:
+                    raise ValueError
+                rect = (max(x0, bounds[0]), max(y0, bounds[1]), min(x1, bounds[2]), min(y1, bounds[3]))
+            except (ValueError, KeyError, TypeError):
+                raise ValueError(f"{os.path.basename(path)}, line {line_number}: not a valid annotation") from None
+            records.append((page_number, kind, rect, text if kind == 'text_note' else None))
+    for page_number, kind, rect, text in records:
+        store.add(page_number, kind, rect, text)
+    return len(records)
+
+
+class PerfRecorder:
+    """Durations and counters of the viewer's hot paths, with an optional JSON Lines trace.
+
+    Every named series keeps its last `window` durations for percentiles, plus a
+    running count and total. While a trace is open, every duration is also
+    written to it as one JSON object with its fields (page number, document...),
+    so a slow document can be examined after the session.
+    """
+
+    def __init__(self, window=1024):
+        self.window = window
+        self.trace_file = None
+        self.trace_path = None
+        self.reset()
+
+    def reset(self):
+        """Forget every duration and counter."""
+        self.samples = {}  # Series name -> deque of the latest durations in seconds
+        self.totals = {}  # Series name -> [count, total seconds]
+        self.counters = {}  # Counter name -> value
+
+    def record(self, name, seconds, **fields):
+        """Add one duration to a series, and to the trace if one is open."""
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=self.window)
+            self.totals[name] = [0, 0.0]
+        samples.append(seconds)
+        total = self.totals[name]
+        total[0] += 1
+        total[1] += seconds
+        if self.trace_file is not None:
+            event = {'time': round(time.time(), 6), 'event': name, 'ms': round(seconds * 1000, 3)}
+            event.update(fields)
+            self.trace_file.write(json.dumps(event, default=str) + '\n')
+
+    @contextmanager
+    def timed(self, name, **fields):
+        """Record how long the body of a with statement takes."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started, **fields)
+
+    def count(self, name, amount=1):
+        """Add to a counter."""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def percentiles(self, name, points=(50, 90, 99)):
+        """Return {point: seconds} over the latest durations of a series, or None if it has none."""
+        samples = sorted(self.samples.get(name, ()))
+        if not samples:
+            return None
+        return {point: samples[min(len(samples) - 1, len(samples) * point // 100)] for point in points}
+
+    def summary(self):
+        """Return (name, count, mean, p50, p90, p99, max) per series, durations in seconds, by name."""
+        rows = []
+        for name in sorted(self.samples):
+            count, total = self.totals[name]
+            points = self.percentiles(name)
+            rows.append((name, count, total / count, points[50], points[90], points[99], max(self.samples[name])))
+        return rows
+
+    def start_trace(self, path):
+        """Append every duration recorded from now on to a JSON Lines file."""
+        self.stop_trace()
+        # Line buffered, so the trace survives a crash of the viewer
+        self.trace_file = open(path, 'a', encoding='utf-8', buffering=1)
+        self.trace_path = path
+
+    def stop_trace(self):
+        """Close the trace file, if one is open."""
+        if self.trace_file is not None:
+            self.trace_file.close()
+        self.trace_file = None
+        self.trace_path = None
+
+
+def resident_memory():
+    """Return the resident memory of this process in bytes, or None where it cannot be read."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+SAVE_PRESETS = {
+    # Name -> keyword arguments of Document.save
+    'fast': {},
+    'compact': {'garbage': 3, 'deflate': True},
+    'smallest': {'garbage': 4, 'deflate': True, 'deflate_images': True, 'deflate_fonts': True, 'clean': True},
+}
+
+
+def parse_page_spec(spec, page_count, toc=None):
+    """Parse a split specification into a list of (first, last, title) parts, 0-based and inclusive.
+
+    The specification is either "every N", "bookmarks" (top-level bookmarks;
+    "bookmarks:L" splits at bookmarks up to level L), or comma-separated page
+    ranges such as "1-3, 5, 8-" where a missing end runs to the last page and a
+    missing start begins at the first. Raises ValueError when it cannot be parsed.
+    """
+    spec = spec.strip().lower()
+    if spec.startswith('every'):
+        step = int(spec[len('every'):].strip())
+        if step < 1:
+            raise ValueError("the number of pages per part must be at least 1")
+        return [(first, min(first + step, page_count) - 1, None) for first in range(0, page_count, step)]
+
+    if spec.startswith('bookmarks'):
+        level = int(spec.partition(':')[2] or 1)
+        starts = [(page - 1, title) for entry_level, title, page in toc or []
+                  if entry_level <= level and 1 <= page <= page_count]
+        if not starts:
+            raise ValueError("the document has no bookmarks to split at")
+        starts.sort(key=lambda start: start[0])
+        if starts[0][0] > 0:
+            starts.insert(0, (0, None))
+        # Bookmarks pointing at the same page start one part, named after the first of them
+        starts = [start for i, start in enumerate(starts) if i == 0 or start[0] != starts[i - 1][0]]
+        return [(first, next_first - 1, title)
+                for (first, title), (next_first, _) in zip(starts, starts[1:] + [(page_count, None)])]
+
+    parts = []
+    for part in filter(str.strip, spec.split(',')):
+        start, dash, end = part.strip().partition('-')
+        first = int(start) if start.strip() else 1
+        last = (int(end) if end.strip() else page_count) if dash else first
+        if not 1 <= first <= last <= page_count:
+            raise ValueError(f"page range {part.strip()} is outside pages 1-{page_count}")
+        parts.append((first - 1, last - 1, None))
+    if not parts:
+        raise ValueError("no pages were given")
+    return parts
+
+
+def part_file_name(index, title=None):
+    """File name of the index-th (0-based) output part of a split, optionally named after a bookmark."""
+    if not title:
+        return f"split_part_{index + 1}.pdf"
+    title = re.sub(r'[^\w\- ]+', '', title).strip()[:60]
+    return f"split_part_{index + 1}_{title}.pdf" if title else f"split_part_{index + 1}.pdf"
+
+
+def write_pdf_part(source, first, last, output_path, save_options=None):
+    """Copy pages first..last of the source document into a new file in one operation; returns the page count."""
+    part = fitz.open()
+    try:
+        part.insert_pdf(source, from_page=first, to_page=last)
+        part.save(output_path, **(save_options or {}))
+        return len(part)
+    finally:
+        part.close()
+
+
+def split_parts(path, parts, save_options=None):
+    """Write a batch of (first, last, output_path) parts of the document at path; runs inside a worker process.
+
+    Returns (parts written, pages written).
+    """
+    source = open_worker_document(path)
+    pages = sum(write_pdf_part(source, first, last, output_path, save_options) for first, last, output_path in parts)
+    return len(parts), pages
+
+
+def append_merge_batch(partial_path, paths, first_batch, save_options=None):
+    """Append the documents at paths to the partial merge at partial_path; runs inside a worker process.
+
+    The batch is first collected in memory and serialized with save_options, so
+    fonts and images that the inputs share are stored once when the options merge
+    duplicate objects. The partial file then grows by an incremental save, so only
+    one batch is ever held in memory. Returns (pages in the partial merge, TOC
+    entries of the batch with their final page numbers).
+    """
+    merged = fitz.open() if first_batch else fitz.open(partial_path)
+    try:
+        base = len(merged)
+        batch = fitz.open()
+        toc = []
+        for path in paths:
+            with fitz.open(path) as document:
+                if not document.is_pdf:
+                    raise ValueError(f"{os.path.basename(path)} is not a PDF file")
+                start = base + len(batch) + 1
+                batch.insert_pdf(document)
+                toc.append([1, os.path.splitext(os.path.basename(path))[0], start])
+                toc.extend([level + 1, title, start + page - 1] for level, title, page in document.get_toc(simple=True))
+        data = batch.tobytes(**(save_options or {}))
+        batch.close()
+        with fitz.open('pdf', data) as batch:
+            merged.insert_pdf(batch)
+        if first_batch:
+            merged.save(partial_path)
+        else:
+            merged.saveIncr()
+        return len(merged), toc
+    finally:
+        merged.close()
+
+
+def finish_merge(partial_path, output_path, toc, save_options=None):
+    """Write the partial merge to output_path with its rebuilt TOC and remove it; returns the page count."""
+    with fitz.open(partial_path) as merged:
+        # Input outlines can skip levels, which set_toc rejects
+        previous = 0
+        for entry in toc:
+            entry[0] = previous = min(entry[0], previous + 1)
+        merged.set_toc(toc)
+        merged.save(output_path, **(save_options or {}))
+        pages = len(merged)
+    os.remove(partial_path)
+    return pages
+
+
+def save_document(document, output_path=None, save_options=None):
+    """Save a modified document to output_path, or incrementally in place when there is none."""
+    if output_path:
+        document.save(output_path, **(save_options or {}))
+    else:
+        document.saveIncr()
+
+
+def rotate_document(path, angle, pages=None, output_path=None):
+    """Turn the given pages (all by default) of the document at path by angle degrees clockwise.
+
+    Returns the number of pages turned.
+    """
+    with fitz.open(path) as document:
+        pages = range(len(document)) if pages is None else pages
+        for page_number in pages:
+            page = document.load_page(page_number)
+            page.set_rotation((page.rotation + angle) % 360)
+        save_document(document, output_path)
+        return len(pages)
+
+
+def update_metadata(path, fields, output_path=None):
+    """Set the given metadata fields (title, author, ...) of the document at path; returns the new metadata."""
+    with fitz.open(path) as document:
+        metadata = dict(document.metadata)
+        metadata.update(fields)
+        document.set_metadata(metadata)
+        save_document(document, output_path)
+        return document.metadata
+
+
+def add_pdf_annotation(page, annotation_type, data):
+    """Add a viewer annotation to a page as a native PDF annotation and return it.
+
+    data is in page coordinates: a (x0, y0, x1, y1) rectangle for highlights and
+    rectangles, and {'pos': (x, y), 'text': text} for text notes.
+    """
+    if annotation_type == 'highlight':
+        annotation = page.add_highlight_annot(fitz.Rect(data))
+    elif annotation_type == 'rectangle':
+        annotation = page.add_rect_annot(fitz.Rect(data))
+        annotation.set_colors(stroke=(0, 0, 1))
+        annotation.set_border(width=3)
+        # Only the rectangle changes after creation; highlights and notes already
+        # have their appearance, and every update() costs PyMuPDF a few milliseconds
+        annotation.update()
+    elif annotation_type == 'text_note':
+        annotation = page.add_text_annot(fitz.Point(data['pos']), data['text'])
+    else:
+        raise ValueError(f"unknown annotation type {annotation_type!r}")
+    return annotation
+
+
+def delta_size(delta):
+    """Estimate the bytes an edit delta of EditHistory keeps alive."""
+    size = sys.getsizeof(delta)
+    for part in delta:
+        size += sys.getsizeof(part)
+        if isinstance(part, dict):
+            size += sum(sys.getsizeof(value) for value in part.values())
+    return size
+
+
+class EditHistory:
+    """Undo and redo stacks of edit deltas, holding at most max_bytes of them.
+
+    A delta is a tuple whose first element names the kind of edit and whose
+    other elements are just enough to apply or revert it, such as the ids of
+    added annotations or the pages turned and the angle. When the history grows
+    past max_bytes the oldest deltas are forgotten.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.size = 0  # Estimated bytes of the deltas on both stacks
+
+    def clear(self):
+        """Forget every delta."""
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.size = 0
+
+    def record(self, delta):
+        """Add the delta of an edit just made; the edits undone before it can no longer be redone."""
+        self.size -= sum(delta_size(undone) for undone in self.redo_stack)
+        self.redo_stack.clear()
+        self.undo_stack.append(delta)
+        self.size += delta_size(delta)
+        while self.size > self.max_bytes and len(self.undo_stack) > 1:
+            self.size -= delta_size(self.undo_stack.popleft())
+
+    def undo(self):
+        """Return the delta to revert next, or None, moving it to the redo stack."""
+        if not self.undo_stack:
+            return None
+        delta = self.undo_stack.pop()
+        self.redo_stack.append(delta)
+        return delta
+
+    def redo(self):
+        """Return the delta to apply again next, or None, moving it back to the undo stack."""
+        if not self.redo_stack:
+            return None
+        delta = self.redo_stack.pop()
+        self.undo_stack.append(delta)
+        return delta
+
+
+class EditJournal:
+    """Edits of an open document, applied to it in memory and written to its file in one incremental save.
+
+    Each edit changes the in-memory document right away, so everything reading
+    from it sees the edit, while the file on disk is only rewritten by flush.
+    A document opened from a repaired copy is given the path of the original
+    file, which flush then rewrites in full; the repaired copy is never written.
+    """
+
+    def __init__(self, document, path=None):
+        self.document = document
+        self.path = path or document.name  # File the edits are saved to
+        self.rotated_pages = set()  # Pages whose rotation changed since the last flush
+        self.metadata_changed = False
+        self.annotated_pages = set()  # Pages with annotations embedded since the last flush
+
+    def set_rotations(self, rotations):
+        """Set the rotation of pages from a {page number: degrees} mapping."""
+        # Look up every page object before writing any, which keeps the page tree lookups cheap
+        xrefs = [(self.document.page_xref(page_number), rotation) for page_number, rotation in rotations.items()]
+        for xref, rotation in xrefs:
+            self.document.xref_set_key(xref, 'Rotate', str(rotation))
+        self.rotated_pages.update(rotations)
+
+    def set_metadata(self, fields):
+        """Update the given metadata fields."""
+        metadata = dict(self.document.metadata)
+        metadata.update(fields)
+        self.document.set_metadata(metadata)
+        self.metadata_changed = True
+
+    def add_annotation(self, page_number, annotation_type, data):
+        """Embed a viewer annotation in a page; see add_pdf_annotation for data."""
+        add_pdf_annotation(self.document.load_page(page_number), annotation_type, data)
+        self.annotated_pages.add(page_number)
+
+    def embed_annotations(self, store, annotation_ids):
+        """Embed annotations of an AnnotationStore as native PDF annotations, one page at a time.
+
+        Returns the numbers of the pages that received annotations.
+        """
+        by_page = {}
+        for annotation_id in annotation_ids:
+            page_number, kind, rect, text = store.get(annotation_id)
+            by_page.setdefault(page_number, []).append((kind, rect, text))
+        for page_number, annotations in sorted(by_page.items()):
+            page = self.document.load_page(page_number)
+            for kind, rect, text in annotations:
+                add_pdf_annotation(page, kind, {'pos': rect[:2], 'text': text} if kind == 'text_note' else rect)
+        self.annotated_pages.update(by_page)
+        return sorted(by_page)
+
+    def pending(self):
+        """Whether there are edits the file on disk does not have yet."""
+        return bool(self.rotated_pages or self.metadata_changed or self.annotated_pages)
+
+    def flush(self):
+        """Write the pending edits with one incremental save; returns whether anything was written."""
+        if not self.pending() or not self.path:
+            return False
+        if self.path == self.document.name:
+            self.document.saveIncr()
+        else:
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            self.document.save(temp_path, garbage=1)
+            os.replace(temp_path, self.path)
+        self.rotated_pages.clear()
+        self.metadata_changed = False
+        self.annotated_pages.clear()
+        return True
@@ -19,37 +19,519 @@
 #
 
 
+import time
+STARTUP_STARTED = time.perf_counter()  # Before the imports, for the startup timings
 import sys
+import bisect
 import fitz  # PyMuPDF
-import json
-import pytesseract
-from PIL import Image
-import subprocess
 import os  # Import the os module
+import heapq
+import itertools
+import multiprocessing
+import statistics
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pdf_engine
+import pdf_cli
+
+if __name__ == '__main__' and pdf_cli.is_cli_command(sys.argv[1:]):
+    # Batch commands run headless and never import PyQt
+    sys.exit(pdf_cli.main(sys.argv[1:]))
+
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QAction, QFileDialog, QLabel, QScrollArea,
     QVBoxLayout, QWidget, QLineEdit, QPushButton, QHBoxLayout, QListWidget,
-    QInputDialog, QMessageBox, QDockWidget, QListWidgetItem, QColorDialog, QFormLayout, QDialog
+    QInputDialog, QMessageBox, QDockWidget, QListWidgetItem, QColorDialog, QFormLayout, QDialog,
+    QCheckBox, QProgressDialog, QTabBar
 )
-from PyQt5.QtGui import QPixmap, QImage, QColor, QPainter, QIcon, QPen, QBrush, QPalette
-from PyQt5.QtCore import Qt, QSize, QPoint, QRect
-from PyQt5.QtPrintSupport import QPrinter, QPrintDialog
+from PyQt5.QtGui import QPixmap, QImage, QColor, QPainter, QIcon, QPen, QBrush, QPalette, QFont, QFontMetrics
+from PyQt5.QtCore import Qt, QSize, QPoint, QRect, QTimer, QObject, pyqtSignal
+
+def image_from_raster(raster):
+    """Build a QImage owning its pixels from a raster returned by pdf_engine."""
+    width, height, stride, components, samples = raster
+    image = QImage(samples, width, height, stride, QImage.Format_RGB888 if components == 3 else QImage.Format_RGBA8888)
+    return image.copy()
+
+
+class RenderScheduler(QObject):
+    """Runs rasterization jobs on a pool of worker processes, most urgent first.
+
+    Each worker process keeps its own handles on the documents it renders. Jobs are
+    identified by a hashable key; finished jobs are reported on the GUI thread
+    through job_finished and job_failed. At most one job per worker is handed to the
+    pool at a time so that priorities and cancellation apply to everything else.
+    Every finished job is timed into recorder, if one is given, as "<kind> job"
+    with the time spent queued and running.
+    """
+
+    PREVIEW = 0  # Low-resolution previews of pages in the viewport
+    VISIBLE = 1  # Pages in the viewport
+    PREFETCH = 2  # Pages in the prefetch margin around the viewport
+    SEARCH = 3  # Page scans of a search running before the index is ready
+    THUMBNAIL = 4  # Sidebar thumbnails
+    BACKGROUND = 5  # Document-wide work such as indexing pages for search
+
+    job_finished = pyqtSignal(object, object)  # Job key, result
+    job_failed = pyqtSignal(object, str)  # Job key, error message
+    future_done = pyqtSignal(object, object)  # Job key, future; emitted from the pool's thread
+
+    def __init__(self, max_workers=None, parent=None, recorder=None):
+        super().__init__(parent)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.recorder = recorder  # pdf_engine.PerfRecorder timing the finished jobs, if any
+        self.executor = None
+        self.pending = []  # Heap of [priority, sequence, key, function, args, active, submitted]
+        self.pending_jobs = {}  # Key -> heap entry of the jobs waiting for a worker
+        self.running = {}  # Key -> future of the jobs handed to the pool
+        self.started = {}  # Key -> (submitted, dispatched) perf_counter() times and pool of the running jobs
+        self.cancelled = set()  # Keys of running jobs whose results must be dropped
+        self.closed = False  # Set by shutdown; the futures still running then report nothing
+        self.sequence = itertools.count()
+        # Queued even on the GUI thread, so a future cancelled by cancel() reports later
+        self.future_done.connect(self.on_future_done, Qt.QueuedConnection)
+
+    def submit(self, key, priority, function, *args):
+        """Queue function(*args) under key, or raise the priority of an identical queued job."""
+        if key in self.running:
+            self.cancelled.discard(key)
+            return
+        entry = self.pending_jobs.get(key)
+        if entry is not None:
+            if priority >= entry[0]:
+                return
+            entry[5] = False
+        entry = [priority, next(self.sequence), key, function, args, True, time.perf_counter()]
+        self.pending_jobs[key] = entry
+        heapq.heappush(self.pending, entry)
+        self.dispatch()
+
+    def cancel(self, predicate):
+        """Cancel every queued or running job whose key satisfies predicate."""
+        for key in [key for key in self.pending_jobs if predicate(key)]:
+            self.pending_jobs.pop(key)[5] = False
+        freed = False
+        for key, future in list(self.running.items()):
+            if not predicate(key):
+                continue
+            # Forget the job before cancelling it, so that on_future_done ignores the
+            # cancelled future and never touches running while we free its worker
+            del self.running[key]
+            if future.cancel():
+                del self.started[key]
+                self.cancelled.discard(key)
+                freed = True
+            else:
+                self.running[key] = future
+                self.cancelled.add(key)
+        if freed:
+            self.dispatch()
+
+    def dispatch(self):
+        """Hand the most urgent queued jobs to idle workers."""
+        while not self.closed and self.pending and len(self.running) < self.max_workers:
+            entry = heapq.heappop(self.pending)
+            if not entry[5]:
+                continue
+            _, _, key, function, args, _, submitted = entry
+            del self.pending_jobs[key]
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            future = self.executor.submit(pdf_engine.timed_job, function, *args)
+            self.running[key] = future
+            self.started[key] = (submitted, time.perf_counter(), self.executor)
+            future.add_done_callback(lambda future, key=key: self.report_done(key, future))
+
+    def report_done(self, key, future):
+        """Pass a finished future to the GUI thread; runs on the pool's thread."""
+        # After shutdown the scheduler may already be deleted along with its signal
+        if not self.closed:
+            self.future_done.emit(key, future)
+
+    def on_future_done(self, key, future):
+        """Report a finished job on the GUI thread and start the next one."""
+        if self.running.get(key) is future:
+            del self.running[key]
+            submitted, dispatched, executor = self.started.pop(key)
+            if key in self.cancelled:
+                self.cancelled.discard(key)
+            elif not future.cancelled():
+                error = future.exception()
+                if isinstance(error, BrokenProcessPool) and executor is self.executor:
+                    # A worker died; stop what is left of the pool and start a fresh one for the next jobs
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self.executor = None
+                if error is not None:
+                    self.job_failed.emit(key, str(error))
+                else:
+                    result, seconds = future.result()
+                    if self.recorder is not None:
+                        self.recorder.record(f"{key[0]} job", time.perf_counter() - submitted,
+                                             queue_ms=round((dispatched - submitted) * 1000, 3),
+                                             run_ms=round(seconds * 1000, 3), key=key[1:])
+                    self.job_finished.emit(key, result)
+        self.dispatch()
+
+    def shutdown(self):
+        """Drop all queued jobs and stop the worker processes."""
+        self.closed = True
+        self.cancel(lambda key: True)
+        self.running.clear()
+        self.started.clear()
+        self.cancelled.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+def paint_annotation(painter, annotation_type, data):
+    """Draw one viewer annotation with the given painter."""
+    if annotation_type == 'highlight':
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(255, 255, 0, 100))  # Yellow with transparency
+        painter.drawRect(data)
+    elif annotation_type == 'rectangle':
+        painter.setPen(QPen(QColor(0, 0, 255), 3, Qt.SolidLine))
+        painter.setBrush(Qt.NoBrush)
+        painter.drawRect(data)
+    elif annotation_type == 'text_note':
+        painter.setPen(QPen(QColor(0, 0, 0)))
+        painter.drawText(data['rect'], Qt.AlignLeft | Qt.AlignTop | Qt.TextDontClip, data['text'])
+
+
+class AnnotationOverlay(QWidget):
+    """Transparent layer over a page label that draws the page's annotations.
+
+    The overlay is painted separately from the page raster, so adding an
+    annotation or dragging out a new one only repaints the damaged region of the
+    overlay and never touches the rendered page.
+    """
+
+    note_font_size = 12  # Pixel size of note text at zoom 1, so notes scale with the page
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.store = None  # AnnotationStore of the document
+        self.page_number = None
+        self.matrix = fitz.Identity  # Page coordinates -> overlay pixels
+        self.zoom = 1.0
+        self.rubber_band = None  # (type, rect) of the annotation being dragged out, if any
+        self.highlights = []  # (rect, is current) search hits on the page
+        self.recorder = None  # pdf_engine.PerfRecorder timing the annotation painting, if any
+
+    def set_page(self, store, page_number, matrix, zoom):
+        """Show the annotations of a page from store, drawn through matrix at the given zoom."""
+        self.store = store
+        self.page_number = page_number
+        self.matrix = matrix
+        self.zoom = zoom
+        self.update()
+
+    def pixel_rect(self, rect):
+        """Return the overlay area covered by an (x0, y0, x1, y1) rectangle in page coordinates."""
+        irect = (fitz.Rect(rect) * self.matrix).irect
+        return QRect(irect.x0, irect.y0, irect.width, irect.height)
+
+    def page_rect(self, rect):
+        """Return the page coordinates, as an (x0, y0, x1, y1) tuple, of an overlay area."""
+        page_rect = fitz.Rect(rect.x(), rect.y(), rect.x() + rect.width(), rect.y() + rect.height()) * ~self.matrix
+        return tuple(page_rect.normalize())
+
+    def page_point(self, pos):
+        """Return the page coordinates, as an (x, y) tuple, of an overlay pixel."""
+        point = fitz.Point(pos.x(), pos.y()) * ~self.matrix
+        return point.x, point.y
+
+    def note_font(self):
+        """Return the font notes are drawn with at the current zoom."""
+        font = QFont(self.font())
+        font.setPixelSize(max(1, round(self.note_font_size * self.zoom)))
+        return font
+
+    def set_rubber_band(self, rubber_band):
+        """Show, move or hide the annotation being dragged out, repainting only what changed."""
+        damaged = QRect()
+        if self.rubber_band is not None:
+            damaged = damaged.united(self.rubber_band[1].normalized().adjusted(-2, -2, 2, 2))
+        self.rubber_band = rubber_band
+        if rubber_band is not None:
+            damaged = damaged.united(rubber_band[1].normalized().adjusted(-2, -2, 2, 2))
+        if not damaged.isEmpty():
+            self.update(damaged)
+
+    def update_annotation(self, annotation_id):
+        """Repaint the area covered by one annotation, pen included."""
+        self.update(self.pixel_rect(self.store.rect(annotation_id)).adjusted(-2, -2, 2, 2))
+
+    def set_highlights(self, highlights):
+        """Replace the search hits shown on the page."""
+        damaged = QRect()
+        for rect, _ in self.highlights + highlights:
+            damaged = damaged.united(rect)
+        self.highlights = highlights
+        if not damaged.isEmpty():
+            self.update(damaged)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setPen(Qt.NoPen)
+        for rect, is_current in self.highlights:
+            if rect.intersects(event.rect()):
+                # Current hit in orange, the others in yellow, both with transparency
+                painter.setBrush(QColor(255, 140, 0, 120) if is_current else QColor(255, 255, 0, 100))
+                painter.drawRect(rect)
+        if self.store is not None:
+            started = time.perf_counter()
+            # Only the annotations under the damaged area are looked up and drawn
+            painter.setFont(self.note_font())
+            for annotation_id in self.store.query(self.page_number, self.page_rect(event.rect().adjusted(-2, -2, 2, 2))):
+                _, annotation_type, rect, text = self.store.get(annotation_id)
+                rect = self.pixel_rect(rect)
+                paint_annotation(painter, annotation_type, {'rect': rect, 'text': text} if text is not None else rect)
+            if self.recorder is not None:
+                self.recorder.record('annotation paint', time.perf_counter() - started, page=self.page_number)
+        if self.rubber_band is not None:
+            paint_annotation(painter, *self.rubber_band)
+        painter.end()
+
+
+class PageLabel(QLabel):
+    """Label showing one page, either as a single pixmap or as a grid of tiles.
+
+    Until the sharp render arrives, a low-resolution preview is stretched over the
+    whole label. Annotations are drawn by an overlay on top of the page.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.preview = None  # Low-resolution pixmap of the page, drawn scaled to the label
+        self.tiles = {}  # (column, row) -> (render key, position, pixmap) of the tiles on display
+        self.overlay = AnnotationOverlay(self)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.overlay.resize(self.size())
+
+    def set_preview(self, pixmap):
+        """Show a low-resolution pixmap of the page until the sharp render replaces it."""
+        self.preview = pixmap
+        self.update()
+
+    def paintEvent(self, event):
+        if self.preview is not None:
+            painter = QPainter(self)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            painter.drawPixmap(self.rect(), self.preview)
+            painter.end()
+        super().paintEvent(event)
+        if self.tiles:
+            painter = QPainter(self)
+            for _, position, pixmap in self.tiles.values():
+                if event.rect().intersects(QRect(position, pixmap.size())):
+                    painter.drawPixmap(position, pixmap)
+            painter.end()
+
+
+class RenderCache:
+    """Least-recently-used cache of rendered page pixmaps bounded by a byte budget.
+
+    Entries are keyed by (document, page number, zoom factor, rotation), so a
+    change to any of these simply misses the cache. Annotations are drawn by an
+    overlay and never baked into the cached pixmaps. One cache serves every open
+    document; when it is over budget the entries of documents other than
+    active_document are evicted before those of the document on display.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.active_document = None  # Document whose entries are evicted last
+        self.entries = OrderedDict()  # Key -> (pixmap, size in bytes), oldest first
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def pixmap_bytes(pixmap):
+        """Return the approximate memory used by a pixmap."""
+        return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+    def get(self, key):
+        """Return the cached pixmap for key, or None, updating the hit/miss counters."""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, pixmap):
+        """Store a pixmap and evict the least recently used entries above the budget."""
+        self.remove(key)
+        size = self.pixmap_bytes(pixmap)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (pixmap, size)
+        self.current_bytes += size
+        self.evict()
+
+    def remove(self, key):
+        """Drop a single entry if present."""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+    def evict(self):
+        """Evict least recently used entries until the cache fits its budget, background documents first."""
+        if self.current_bytes > self.max_bytes:
+            for key in [key for key in self.entries if key[0] != self.active_document]:
+                if self.current_bytes <= self.max_bytes:
+                    break
+                self.remove(key)
+                self.evictions += 1
+        while self.current_bytes > self.max_bytes and self.entries:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.current_bytes -= size
+            self.evictions += 1
+
+    def set_max_bytes(self, max_bytes):
+        """Change the byte budget, evicting entries if the cache no longer fits."""
+        self.max_bytes = max_bytes
+        self.evict()
+
+    def clear(self):
+        """Drop every entry."""
+        self.entries.clear()
+        self.current_bytes = 0
+
+    def invalidate_page(self, document, page_number):
+        """Drop every entry of one page of a document."""
+        for key in [key for key in self.entries if key[0] == document and key[1] == page_number]:
+            self.remove(key)
+
+    def invalidate_document(self, document):
+        """Drop every entry of a document."""
+        for key in [key for key in self.entries if key[0] == document]:
+            self.remove(key)
+
+    def stats(self):
+        """Return the cache counters as a dictionary."""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
 
 # Existing PDFViewer class with all your previous code
 class PDFViewer(QMainWindow):
+    # Attributes describing the document on display, kept in its tab while another one is shown
+    DOCUMENT_ATTRIBUTES = ('pdf_document', 'zoom_factor', 'current_page', 'search_results', 'current_search_index',
+                           'search_index', 'bookmarks', 'annotations', 'page_rects', 'page_rotations',
+                           'document_digest', 'edit_journal', 'edit_history', 'layout_next_page')
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("PDF Viewer")
         self.pdf_document = None
         self.zoom_factor = 1.0  # Initial zoom factor
         self.current_page = 0
-        self.search_results = []
+        self.search_results = []  # (page number, [word rectangles in page coordinates]) per hit
         self.current_search_index = -1
+        self.search_index = None  # pdf_engine.SearchIndex of the open document, once built
+        self.search_generation = 0  # Bumped for every query, tags the page scans it started
+        self.search_scan_pending = 0  # Page chunks of the current scan still to be searched
+        self.search_chunk_pages = 25  # Pages searched per job when scanning without the index
+        self.index_chunk_pages = 50  # Pages indexed per job while the search index is built
+        self.index_builds = {}  # (path, digest) -> state of the search indexes being built
+        self.ocr_dpi = 300  # Resolution pages are rendered at for OCR
+        self.ocr_jobs = {}  # State of the OCR conversions in progress, by job number
+        self.ocr_job_numbers = itertools.count()
+        self.ocr_cache = pdf_engine.OcrCache()  # Recognized text kept across conversions
         self.bookmarks = {}  # Dictionary to store bookmarks with names
-        self.annotations = {}  # Dictionary to store annotations
+        self.annotations = pdf_engine.AnnotationStore()  # Annotations in page coordinates, with a spatial index
         self.annotation_mode = None  # Current annotation mode
         self.current_annotation = None  # Temporary storage for the annotation being created
+        self.erase_tolerance = 3  # Pixels a click may miss an annotation by and still erase it
         self.is_night_mode = False  # Night mode flag
+        self.page_rects = []  # Unzoomed page rectangles used to lay out the pages
+        self.page_rotations = []  # Rotation of each page, part of the render cache key
+        self.page_offsets = []  # Top of each page in the pages widget at the current zoom
+        self.page_sizes = []  # Size of each page in pixels at the current zoom
+        self.page_labels = {}  # Labels of the pages currently rendered, by page number
+        self.page_margin = 11  # Space around the pages inside the scroll area
+        self.page_spacing = 6  # Vertical space between consecutive pages
+        self.prefetch_margin = 1.0  # Viewport heights rendered ahead above and below the view
+        self.release_margin = 3.0  # Viewport heights beyond which rendered pages are released
+        self.render_cache = RenderCache()  # Rendered page pixmaps shared across relayouts
+        self.tile_cache = RenderCache(128 * 1024 * 1024)  # Rendered tiles of pages too large for one pixmap
+        self.tile_size = 512  # Edge in pixels of the tiles used for large pages
+        self.tile_threshold = 2048 * 2048  # Pages with more pixels than this are rendered as tiles
+        self.preview_zoom = 0.25  # Zoom factor of the quick previews shown before the sharp render
+        self.first_content_starts = {}  # Time each page label appeared, until it shows something
+        self.first_content_latencies = deque(maxlen=256)  # Seconds from page label to first content
+        self.startup_timings = None  # Seconds taken by each startup step, once main() starts timing them
+        self.startup_clock = None  # perf_counter() at the end of the last startup step, until the first page shows
+        self.displayed_keys = {}  # Render cache key of the pixmap shown by each page label
+        self.print_job = None  # State of the print job in progress, if any
+        self.max_print_dpi = 600  # Highest resolution pages are rasterized at for printing
+        self.split_job = None  # State of the split in progress, if any
+        self.split_job_numbers = itertools.count()
+        self.split_batch_pages = 100  # Pages of small split parts grouped into one worker job
+        self.merge_job = None  # State of the merge in progress, if any
+        self.merge_job_numbers = itertools.count()
+        self.merge_batch_size = 50  # Input files appended to a merge per worker job
+        self.thumbnail_zoom = 0.2  # Thumbnail zoom factor (adjust for desired thumbnail size)
+        self.thumbnail_pages = set()  # Pages whose sidebar item shows its thumbnail
+        self.thumbnail_prefetch = 10  # Items rendered ahead above and below the visible ones
+        self.thumbnail_disk_cache = pdf_engine.ThumbnailCache()  # Thumbnails kept across sessions
+        self.document_digest = None  # Content digest of the open file, keys the disk caches
+        self.edit_journal = None  # Edits of the open document not yet saved to its file
+        self.edit_flush_delay = 30000  # Milliseconds after the last edit before it is saved
+        self.max_undo_bytes = 8 * 1024 * 1024  # Memory the undo history may keep before forgetting old edits
+        self.documents = []  # Tabs of the open documents, in tab order: {'file', 'path', 'state'}
+        self.active_document = None  # Tab index of the document on display
+        self.document_handles = OrderedDict()  # Path -> tab of the documents with an open fitz handle, least recent first
+        self.max_open_documents = 4  # fitz handles kept open so switching back to a tab is instant
+        self.open_job = None  # State of the document being opened by a worker, if any
+        self.open_job_numbers = itertools.count()
+        self.background_open_bytes = 64 * 1024 * 1024  # Files this large are opened by a worker first, which repairs them
+        self.repair_cache_dir = pdf_engine.cache_directory('repaired')  # Repaired copies of damaged files
+        self.layout_chunk_pages = 500  # Page sizes read per event-loop turn while a document is laid out
+        self.layout_next_page = 0  # First page of the open document whose size is still estimated
+
+        self.perf = pdf_engine.PerfRecorder()  # Timings of the hot paths, shown by the performance panel
+        self.perf_refresh_interval = 1000  # Milliseconds between updates of the performance panel
+
+        # The sidebars and the search index of a newly opened document are prepared after its first pages
+        self.document_panels_timer = QTimer(self)
+        self.document_panels_timer.setSingleShot(True)
+        self.document_panels_timer.setInterval(0)
+        self.document_panels_timer.timeout.connect(self.load_document_panels)
+
+        # The sizes of the pages past the first screens are read a chunk at a time
+        self.layout_timer = QTimer(self)
+        self.layout_timer.setSingleShot(True)
+        self.layout_timer.setInterval(0)
+        self.layout_timer.timeout.connect(self.load_page_rects_chunk)
+
+        # Edits are saved together once editing pauses
+        self.edit_flush_timer = QTimer(self)
+        self.edit_flush_timer.setSingleShot(True)
+        self.edit_flush_timer.timeout.connect(self.save_edits)
+
+        # Rasterization runs on worker processes; results come back through signals
+        self.render_scheduler = RenderScheduler(parent=self, recorder=self.perf)
+        self.render_scheduler.job_finished.connect(self.render_job_finished)
+        self.render_scheduler.job_failed.connect(self.render_job_failed)
 
         # Central widget
         self.central_widget = QWidget()
@@ -64,30 +546,58 @@ class PDFViewer(QMainWindow):
         self.search_input.setPlaceholderText("Search...")
         self.search_bar_layout.addWidget(self.search_input)
         
+        self.search_input.returnPressed.connect(self.search_text)
+        self.search_input.textChanged.connect(self.cancel_search_scan)
+
+        self.match_case_checkbox = QCheckBox("Match case", self)
+        self.search_bar_layout.addWidget(self.match_case_checkbox)
+
         self.search_button = QPushButton("Search", self)
-        # self.search_button.clicked.connect(self.search_text)
+        self.search_button.clicked.connect(self.search_text)
         self.search_bar_layout.addWidget(self.search_button)
         
         self.next_result_button = QPushButton("Next", self)
-        # self.next_result_button.clicked.connect(self.next_search_result)
+        self.next_result_button.clicked.connect(self.next_search_result)
         self.search_bar_layout.addWidget(self.next_result_button)
         
         self.prev_result_button = QPushButton("Previous", self)
-        # self.prev_result_button.clicked.connect(self.prev_search_result)
+        self.prev_result_button.clicked.connect(self.prev_search_result)
         self.search_bar_layout.addWidget(self.prev_result_button)
+
+        self.search_status_label = QLabel(self)
+        self.search_bar_layout.addWidget(self.search_status_label)
         
         self.main_layout.addLayout(self.search_bar_layout)
 
+        # One tab per open document, all shown in the same scroll area
+        self.tab_bar = QTabBar(self)
+        self.tab_bar.setTabsClosable(True)
+        self.tab_bar.setExpanding(False)
+        self.tab_bar.setDocumentMode(True)
+        self.tab_bar.currentChanged.connect(self.switch_document)
+        self.tab_bar.tabCloseRequested.connect(self.close_tab)
+        self.main_layout.addWidget(self.tab_bar)
+
         # Scroll area to hold the PDF content
         self.scroll_area = QScrollArea(self)
         self.main_layout.addWidget(self.scroll_area)
         
-        # Container widget inside scroll area to hold all page labels
+        # Container widget inside scroll area to hold the page labels. Pages are
+        # positioned by hand from their computed offsets, and only the pages near
+        # the viewport have a label at all.
         self.pages_widget = QWidget()
-        self.pages_layout = QVBoxLayout(self.pages_widget)
         self.scroll_area.setWidget(self.pages_widget)
         self.scroll_area.setWidgetResizable(True)
 
+        # Scrolling or resizing schedules a single coalesced visible-pages update
+        self.visible_pages_timer = QTimer(self)
+        self.visible_pages_timer.setSingleShot(True)
+        self.visible_pages_timer.setInterval(0)
+        self.visible_pages_timer.timeout.connect(self.update_visible_pages)
+        self.scroll_area.verticalScrollBar().valueChanged.connect(self.schedule_visible_pages_update)
+        self.scroll_area.verticalScrollBar().rangeChanged.connect(self.schedule_visible_pages_update)
+        self.scroll_area.horizontalScrollBar().valueChanged.connect(self.schedule_visible_pages_update)
+
         # Create menu bar
         self.create_menu()
 
@@ -103,14 +613,39 @@ class PDFViewer(QMainWindow):
         self.thumbnail_dock = QDockWidget("Thumbnails", self)
         self.thumbnail_list_widget = QListWidget()
         self.thumbnail_list_widget.setIconSize(QSize(100, 150))  # Set icon size for thumbnails
+        self.thumbnail_list_widget.setUniformItemSizes(True)
         self.thumbnail_dock.setWidget(self.thumbnail_list_widget)
         self.addDockWidget(Qt.LeftDockWidgetArea, self.thumbnail_dock)
         self.thumbnail_dock.setVisible(False)
+
+        # Dock widget for the performance panel, refreshed only while it is shown
+        self.perf_dock = QDockWidget("Performance", self)
+        self.perf_label = QLabel()
+        self.perf_label.setAlignment(Qt.AlignLeft | Qt.AlignTop)
+        self.perf_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        perf_font = QFont("monospace")
+        perf_font.setStyleHint(QFont.TypeWriter)
+        self.perf_label.setFont(perf_font)
+        self.perf_dock.setWidget(self.perf_label)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.perf_dock)
+        self.perf_dock.setVisible(False)
+        self.perf_timer = QTimer(self)
+        self.perf_timer.setInterval(self.perf_refresh_interval)
+        self.perf_timer.timeout.connect(self.update_perf_panel)
+        self.perf_dock.visibilityChanged.connect(self.perf_panel_visibility_changed)
         self.thumbnail_list_widget.itemClicked.connect(self.thumbnail_item_clicked)
 
-        # Undo/Redo stacks
-        self.undo_stack = []
-        self.redo_stack = []
+        # Only the thumbnails of the items in view are rendered
+        self.visible_thumbnails_timer = QTimer(self)
+        self.visible_thumbnails_timer.setSingleShot(True)
+        self.visible_thumbnails_timer.setInterval(0)
+        self.visible_thumbnails_timer.timeout.connect(self.update_visible_thumbnails)
+        self.thumbnail_list_widget.verticalScrollBar().valueChanged.connect(self.visible_thumbnails_timer.start)
+        self.thumbnail_list_widget.verticalScrollBar().rangeChanged.connect(self.visible_thumbnails_timer.start)
+        self.thumbnail_dock.visibilityChanged.connect(self.visible_thumbnails_timer.start)
+
+        # Undo/Redo history of edit deltas
+        self.edit_history = pdf_engine.EditHistory(self.max_undo_bytes)
 
     def create_menu(self):
         # Create the menu bar
@@ -124,6 +659,12 @@ class PDFViewer(QMainWindow):
         open_action.triggered.connect(self.open_file)
         file_menu.addAction(open_action)
 
+        # Save action
+        save_action = QAction('Save', self)
+        save_action.setShortcut('Ctrl+S')
+        save_action.triggered.connect(self.save_edits)
+        file_menu.addAction(save_action)
+
         # Print PDF action
         print_action = QAction('Print PDF', self)
         print_action.triggered.connect(self.print_pdf)
@@ -144,11 +685,13 @@ class PDFViewer(QMainWindow):
 
         # Undo action
         undo_action = QAction('Undo', self)
+        undo_action.setShortcut('Ctrl+Z')
         undo_action.triggered.connect(self.undo)
         edit_menu.addAction(undo_action)
 
         # Redo action
         redo_action = QAction('Redo', self)
+        redo_action.setShortcut('Ctrl+Y')
         redo_action.triggered.connect(self.redo)
         edit_menu.addAction(redo_action)
 
@@ -195,6 +738,65 @@ class PDFViewer(QMainWindow):
         night_mode_action.triggered.connect(self.toggle_night_mode)
         view_menu.addAction(night_mode_action)
 
+        # Render cache size action
+        cache_size_action = QAction('Render Cache Size...', self)
+        cache_size_action.triggered.connect(self.set_render_cache_size)
+        view_menu.addAction(cache_size_action)
+
+        # Render cache statistics action
+        cache_stats_action = QAction('Render Cache Statistics', self)
+        cache_stats_action.triggered.connect(self.show_render_cache_stats)
+        view_menu.addAction(cache_stats_action)
+
+        # Performance panel action
+        self.perf_panel_action = QAction('Performance Panel', self)
+        self.perf_panel_action.setCheckable(True)
+        self.perf_panel_action.triggered.connect(self.toggle_perf_panel)
+        view_menu.addAction(self.perf_panel_action)
+
+        # Timing trace actions
+        start_trace_action = QAction('Start Timing Trace...', self)
+        start_trace_action.triggered.connect(self.start_timing_trace)
+        view_menu.addAction(start_trace_action)
+
+        stop_trace_action = QAction('Stop Timing Trace', self)
+        stop_trace_action.triggered.connect(self.stop_timing_trace)
+        view_menu.addAction(stop_trace_action)
+
+        # Annotations menu
+        annotations_menu = menubar.addMenu('Annotations')
+
+        # Annotation tool actions
+        highlight_action = QAction('Highlight', self)
+        highlight_action.triggered.connect(self.activate_highlight_mode)
+        annotations_menu.addAction(highlight_action)
+
+        draw_rect_action = QAction('Rectangle', self)
+        draw_rect_action.triggered.connect(self.activate_draw_rect_mode)
+        annotations_menu.addAction(draw_rect_action)
+
+        text_note_action = QAction('Text Note', self)
+        text_note_action.triggered.connect(self.activate_text_note_mode)
+        annotations_menu.addAction(text_note_action)
+
+        erase_annotation_action = QAction('Erase Annotation', self)
+        erase_annotation_action.triggered.connect(self.activate_erase_mode)
+        annotations_menu.addAction(erase_annotation_action)
+        annotations_menu.addSeparator()
+
+        # Import, export and embed actions
+        import_annotations_action = QAction('Import Annotations...', self)
+        import_annotations_action.triggered.connect(self.import_annotations)
+        annotations_menu.addAction(import_annotations_action)
+
+        export_annotations_action = QAction('Export Annotations...', self)
+        export_annotations_action.triggered.connect(self.export_annotations)
+        annotations_menu.addAction(export_annotations_action)
+
+        embed_annotations_action = QAction('Embed Annotations in PDF', self)
+        embed_annotations_action.triggered.connect(self.embed_annotations)
+        annotations_menu.addAction(embed_annotations_action)
+
         # Bookmark menu
         bookmark_menu = menubar.addMenu('Bookmark')
         
@@ -232,6 +834,11 @@ class PDFViewer(QMainWindow):
         convert_pdf_to_odt_action.triggered.connect(self.convert_pdf_to_odt)
         ocr_menu.addAction(convert_pdf_to_odt_action)
 
+        # OCR resolution action
+        ocr_dpi_action = QAction('OCR Resolution...', self)
+        ocr_dpi_action.triggered.connect(self.set_ocr_dpi)
+        ocr_menu.addAction(ocr_dpi_action)
+
         # Help menu
         help_menu = menubar.addMenu('Help')
         
@@ -263,53 +870,646 @@ class PDFViewer(QMainWindow):
             self.load_pdf(file_path)
 
     def load_pdf(self, file_path):
-        self.pdf_document = fitz.open(file_path)
+        """Open a PDF in a new tab, or switch to its tab if it is already open.
+
+        Large files are opened by a worker first, in the background, so a file
+        MuPDF has to repair does not freeze the window.
+        """
+        for index, tab in enumerate(self.documents):
+            if os.path.abspath(tab['file']) == os.path.abspath(file_path):
+                self.tab_bar.setCurrentIndex(index)
+                return
+        if os.path.getsize(file_path) >= self.background_open_bytes:
+            self.start_open_job(file_path)
+        else:
+            self.open_document(file_path, file_path)
+
+    def start_open_job(self, file_path):
+        """Have a worker open a file, repairing it if needed, and show it once it is ready."""
+        if self.open_job is not None:
+            QMessageBox.warning(self, "Open PDF", f"{self.open_job['file_path']} is still being opened.")
+            return
+        job_number = next(self.open_job_numbers)
+        progress = QProgressDialog(f"Opening {os.path.basename(file_path)}...", "Cancel", 0, 0, self)
+        progress.setWindowTitle("Open PDF")
+        progress.setMinimumDuration(500)
+        progress.canceled.connect(lambda: self.finish_open_job(abort=True))
+        self.open_job = {'number': job_number, 'file_path': file_path, 'progress': progress}
+        self.render_scheduler.submit(('open', file_path, job_number), RenderScheduler.PREVIEW,
+                                     pdf_engine.prepare_document, file_path, self.repair_cache_dir)
+
+    def open_job_done(self, job_number, result):
+        """Show a document a worker has opened, from its repaired copy if it needed repair."""
+        job = self.open_job
+        if job is None or job['number'] != job_number:
+            return
+        self.finish_open_job()
+        path, repaired = result
+        try:
+            self.open_document(job['file_path'], path)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"An error occurred while opening {job['file_path']}: {e}")
+            return
+        if repaired:
+            self.tab_bar.setTabToolTip(self.active_document, f"{job['file_path']} (repaired copy: {path})")
+
+    def finish_open_job(self, error=None, abort=False):
+        """End the background open, reporting error if there was one."""
+        job = self.open_job
+        if job is None:
+            return
+        self.open_job = None
+        if abort:
+            self.render_scheduler.cancel(lambda key: key[0] == 'open' and key[2] == job['number'])
+        job['progress'].close()
+        if error:
+            QMessageBox.critical(self, "Error", f"An error occurred while opening {job['file_path']}: {error}")
+
+    def open_document(self, file_path, path):
+        """Show the document at path in a new tab for file_path; path differs for repaired copies."""
+        started = time.perf_counter()
+        document = fitz.open(path)
+        self.save_document_state()
+        self.pdf_document = document
+        self.edit_journal = pdf_engine.EditJournal(self.pdf_document, file_path)
+        self.edit_history = pdf_engine.EditHistory(self.max_undo_bytes)
+        self.annotations = pdf_engine.AnnotationStore()
+        self.bookmarks = {}
+        self.search_results = []
+        self.current_search_index = -1
+        self.document_digest = pdf_engine.file_digest(path)
+        self.current_page = 0
+        self.page_offsets = []
+        self.load_page_rects()
+        self.perf.record('document open', time.perf_counter() - started, pages=len(self.page_rects))
+        self.note_startup_step('open')
+
+        tab = {'file': file_path, 'path': path, 'state': None}
+        self.documents.append(tab)
+        self.active_document = len(self.documents) - 1
+        self.use_document_handle(tab)
+        self.tab_bar.blockSignals(True)
+        self.tab_bar.setCurrentIndex(self.tab_bar.addTab(os.path.basename(file_path)))
+        self.tab_bar.setTabToolTip(self.active_document, file_path)
+        self.tab_bar.blockSignals(False)
+        self.setWindowTitle("PDF Viewer")
         self.display_all_pages()
-        self.load_toc()
-        self.load_thumbnails()
+        self.document_panels_timer.start()
+
+    def load_document_panels(self):
+        """Fill the TOC and thumbnail sidebars and start the search index of the document on display."""
+        if self.pdf_document:
+            self.load_toc()
+            self.load_thumbnails()
+            self.build_search_index()
 
     def close_pdf(self):
-        """Close the current PDF and clear the display."""
+        """Close the PDF of the current tab and show the next tab, if any."""
+        if self.pdf_document:
+            self.save_edits()
+        document = self.pdf_document  # Saving may have replaced a repaired copy with the original
+        if document:
+            self.render_cache.invalidate_document(document.name)
+            self.tile_cache.invalidate_document(document.name)
         self.pdf_document = None
+        self.edit_journal = None
+        self.edit_history.clear()
+        self.edit_flush_timer.stop()
+        self.document_panels_timer.stop()
+        self.layout_timer.stop()
+        self.document_digest = None
+        self.render_scheduler.cancel(lambda key: key[0] == 'thumbnail')
+        self.thumbnail_pages.clear()
         self.search_results.clear()
         self.current_search_index = -1
+        self.search_index = None
+        self.search_status_label.clear()
+        self.cancel_search_scan()
+        if document:
+            if self.print_job is not None and self.print_job['path'] == document.name:
+                self.finish_print_job(abort=True)
+            self.render_scheduler.cancel(lambda key: key[0] in ('search_index', 'index_chunk') and key[1] == document.name)
+            for build_key in [build_key for build_key in self.index_builds if build_key[0] == document.name]:
+                del self.index_builds[build_key]
+            for job_number, job in list(self.ocr_jobs.items()):
+                if job['document'] == document.name:
+                    self.cancel_ocr_job(job_number)
         self.bookmarks.clear()
         self.annotations.clear()
         self.toc_list_widget.clear()
         self.thumbnail_list_widget.clear()
-        for i in reversed(range(self.pages_layout.count())):
-            widget = self.pages_layout.itemAt(i).widget()
-            if widget is not None:
-                widget.setParent(None)
+        self.clear_page_labels()
+        self.page_rects = []
+        self.page_rotations = []
+        self.page_offsets = []
+        self.page_sizes = []
+        self.pages_widget.setMinimumSize(0, 0)
         self.setWindowTitle("PDF Viewer")
         self.toc_dock.setVisible(False)
         self.thumbnail_dock.setVisible(False)
 
-    def display_all_pages(self):
-        """Render and display all pages of the PDF document."""
+        if self.active_document is not None:
+            tab = self.documents.pop(self.active_document)
+            self.document_handles.pop(tab['path'], None)
+            self.tab_bar.blockSignals(True)
+            self.tab_bar.removeTab(self.active_document)
+            self.tab_bar.blockSignals(False)
+            self.active_document = None
+            document.close()
+            if self.documents:
+                self.show_document(self.tab_bar.currentIndex())
+
+    def close_tab(self, index):
+        """Close the document of a tab."""
+        self.tab_bar.setCurrentIndex(index)
+        self.close_pdf()
+
+    def switch_document(self, index):
+        """Show the document of the selected tab."""
+        if index < 0 or index == self.active_document:
+            return
+        self.save_document_state()
+        self.show_document(index)
+
+    def save_document_state(self):
+        """Keep the view state of the document on display in its tab, before another document is shown.
+
+        Pending edits are saved, so documents in background tabs never have any.
+        Their rendered pages stay in the shared caches until the budget needs the
+        room.
+        """
+        if self.active_document is None:
+            return
+        self.save_edits()
+        state = {name: getattr(self, name) for name in self.DOCUMENT_ATTRIBUTES}
+        state['scroll'] = (self.scroll_area.horizontalScrollBar().value(), self.scroll_area.verticalScrollBar().value())
+        self.documents[self.active_document]['state'] = state
+        self.document_panels_timer.stop()
+        self.layout_timer.stop()
+        self.cancel_search_scan()
+        self.render_scheduler.cancel(lambda key: key[0] in ('page', 'tile', 'preview', 'thumbnail'))
+        self.clear_page_labels()
+        self.thumbnail_list_widget.clear()
+        self.thumbnail_pages.clear()
+        self.toc_list_widget.clear()
+        self.search_status_label.clear()
+
+    def show_document(self, index):
+        """Display the document of a tab as it was left, reopening it if its handle was closed."""
+        tab = self.documents[index]
+        for name in self.DOCUMENT_ATTRIBUTES:
+            setattr(self, name, tab['state'][name])
+        if self.pdf_document is None:
+            self.pdf_document = fitz.open(tab['path'])
+            self.edit_journal = pdf_engine.EditJournal(self.pdf_document, tab['file'])
+        self.active_document = index
+        self.use_document_handle(tab)
+        self.setWindowTitle("PDF Viewer")
+        self.page_offsets = []
+        self.display_all_pages()
+        if self.layout_next_page < len(self.page_rects):
+            self.layout_timer.start()
+        horizontal, vertical = tab['state']['scroll']
+        self.scroll_area.horizontalScrollBar().setValue(horizontal)
+        self.scroll_area.verticalScrollBar().setValue(vertical)
+        self.load_toc(report_missing=False)
+        self.load_thumbnails()
+        if self.search_index is None:
+            self.build_search_index()
+        elif self.search_results:
+            self.update_search_status()
+
+    def use_document_handle(self, tab):
+        """Mark the fitz handle of a tab as the most recently used, closing the oldest beyond max_open_documents."""
+        self.document_handles[tab['path']] = tab
+        self.document_handles.move_to_end(tab['path'])
+        while len(self.document_handles) > max(1, self.max_open_documents):
+            _, oldest = self.document_handles.popitem(last=False)
+            # Background tabs have no pending edits, so their journal can go with the handle
+            oldest['state']['pdf_document'].close()
+            oldest['state']['pdf_document'] = None
+            oldest['state']['edit_journal'] = None
+        self.render_cache.active_document = self.pdf_document.name
+        self.tile_cache.active_document = self.pdf_document.name
+
+    def load_page_rects(self):
+        """Read the unzoomed rectangle and rotation of the first pages without rasterizing anything.
+
+        The other pages are laid out with the size of the last page read until
+        load_page_rects_chunk reads theirs, so the first pages show before a
+        document with many pages has been read through.
+        """
+        page_count = len(self.pdf_document)
+        self.page_rects = []
+        self.page_rotations = []
+        for page_number in range(min(page_count, self.layout_chunk_pages)):
+            page = self.pdf_document.load_page(page_number)
+            self.page_rects.append(page.rect)
+            self.page_rotations.append(page.rotation)
+        self.layout_next_page = len(self.page_rects)
+        if self.layout_next_page < page_count:
+            self.page_rects.extend([self.page_rects[-1]] * (page_count - self.layout_next_page))
+            self.page_rotations.extend([self.page_rotations[-1]] * (page_count - self.layout_next_page))
+            self.layout_timer.start()
+
+    def load_page_rects_chunk(self):
+        """Read the sizes of the next pages of the document and lay out again the ones that were estimated wrong."""
+        if not self.pdf_document:
+            return
+        first = self.layout_next_page
+        last = min(len(self.page_rects), first + self.layout_chunk_pages)
+        changed = []
+        with self.perf.timed('layout chunk', first=first, pages=last - first):
+            for page_number in range(first, last):
+                page = self.pdf_document.load_page(page_number)
+                if page.rect != self.page_rects[page_number] or page.rotation != self.page_rotations[page_number]:
+                    self.page_rects[page_number] = page.rect
+                    self.page_rotations[page_number] = page.rotation
+                    changed.append(page_number)
+        self.layout_next_page = last
+        if changed:
+            self.display_all_pages(changed_pages=changed)
+        if last < len(self.page_rects):
+            self.layout_timer.start()
+
+    def clear_page_labels(self):
+        """Remove the labels of all rendered pages."""
+        for page_label in self.page_labels.values():
+            page_label.setParent(None)
+        self.page_labels.clear()
+        self.displayed_keys.clear()
+        self.first_content_starts.clear()
+
+    def display_all_pages(self, changed_pages=None):
+        """Lay out all pages of the PDF document and render the ones near the viewport.
+
+        When changed_pages is given, only those pages are rendered again and the
+        labels of the other pages are just moved to their new positions.
+        """
         if self.pdf_document:
-            # Clear the current layout
-            for i in reversed(range(self.pages_layout.count())):
-                widget = self.pages_layout.itemAt(i).widget()
-                if widget is not None:
-                    widget.setParent(None)
-            
-            # Render each page and add to layout
-            for page_number in range(len(self.pdf_document)):
-                pixmap = self.render_page(page_number)
-                page_label = QLabel(self)
-                page_label.setPixmap(pixmap)
+            # Remember where in the current page the view is, to restore it after relayout
+            scroll_bar = self.scroll_area.verticalScrollBar()
+            anchor_fraction = 0.0
+            if self.current_page < len(self.page_offsets):
+                anchor_height = max(1, self.page_sizes[self.current_page].height())
+                anchor_fraction = (scroll_bar.value() - self.page_offsets[self.current_page]) / anchor_height
+            anchor_page = min(self.current_page, len(self.page_rects) - 1)
+
+            if changed_pages is None:
+                self.clear_page_labels()
+            else:
+                for page_number in changed_pages:
+                    self.release_page_label(page_number)
+
+            # Compute the position of every page from its rectangle at the current zoom
+            mat = fitz.Matrix(self.zoom_factor, self.zoom_factor)
+            self.page_offsets = []
+            self.page_sizes = []
+            y = self.page_margin
+            width = 0
+            for rect in self.page_rects:
+                irect = (rect * mat).irect
+                self.page_offsets.append(y)
+                self.page_sizes.append(QSize(irect.width, irect.height))
+                y += irect.height + self.page_spacing
+                width = max(width, irect.width)
+            self.pages_widget.setMinimumSize(width + 2 * self.page_margin,
+                                             y - self.page_spacing + self.page_margin)
+            for page_number, page_label in self.page_labels.items():
+                page_label.move(self.page_margin, self.page_offsets[page_number])
+
+            if anchor_page >= 0:
+                scroll_bar.setValue(self.page_offsets[anchor_page] +
+                                    int(anchor_fraction * self.page_sizes[anchor_page].height()))
+            self.update_visible_pages()
+
+    def schedule_visible_pages_update(self):
+        """Coalesce scroll and resize notifications into one visible-pages update."""
+        if self.page_offsets:
+            self.visible_pages_timer.start()
+
+    def page_at_offset(self, y):
+        """Return the page covering vertical offset y in the pages widget."""
+        page_number = bisect.bisect_right(self.page_offsets, y) - 1
+        return min(max(page_number, 0), len(self.page_offsets) - 1)
+
+    def visible_page_range(self, margin=0.0):
+        """Return the first and last page within the viewport extended by margin viewport heights."""
+        viewport_height = self.scroll_area.viewport().height()
+        top = self.scroll_area.verticalScrollBar().value() - margin * viewport_height
+        bottom = top + viewport_height + 2 * margin * viewport_height
+        return self.page_at_offset(top), self.page_at_offset(bottom)
+
+    def update_visible_pages(self):
+        """Render the pages in and around the viewport and release those far away from it."""
+        if not self.pdf_document or not self.page_offsets:
+            return
+
+        first_visible, last_visible = self.visible_page_range()
+        self.current_page = first_visible
+
+        first, last = self.visible_page_range(self.prefetch_margin)
+        wanted = set()  # Keys of the render jobs still needed
+        for page_number in range(first, last + 1):
+            if page_number not in self.page_labels:
+                page_label = PageLabel(self.pages_widget)
+                page_label.setGeometry(QRect(QPoint(self.page_margin, self.page_offsets[page_number]),
+                                             self.page_sizes[page_number]))
                 page_label.mousePressEvent = lambda event, p=page_number: self.page_mouse_press(event, p)
                 page_label.mouseMoveEvent = lambda event, p=page_number: self.page_mouse_move(event, p)
                 page_label.mouseReleaseEvent = lambda event, p=page_number: self.page_mouse_release(event, p)
-                self.pages_layout.addWidget(page_label)
+                page_label.overlay.recorder = self.perf
+                page_label.overlay.set_page(self.annotations, page_number, self.page_matrix(page_number), self.zoom_factor)
+                page_label.overlay.highlights = self.page_search_highlights(page_number)
+                page_label.show()
+                self.page_labels[page_number] = page_label
+                self.first_content_starts[page_number] = time.perf_counter()
+            visible = first_visible <= page_number <= last_visible
+            priority = RenderScheduler.VISIBLE if visible else RenderScheduler.PREFETCH
+            if self.is_tiled(page_number):
+                wanted |= self.update_page_tiles(page_number, priority)
+            else:
+                wanted.add(('page',) + self.render_cache_key(page_number))
+                if self.displayed_keys.get(page_number) != self.render_cache_key(page_number):
+                    self.request_page_render(page_number, priority)
+            if page_number in self.first_content_starts and self.page_labels[page_number].preview is None:
+                wanted |= self.request_page_preview(page_number, visible)
+
+        # Renders of pages and tiles that left the prefetch range, or of a previous
+        # zoom or rotation, are no longer needed
+        self.render_scheduler.cancel(lambda key: key[0] in ('page', 'tile', 'preview') and key not in wanted)
+
+        keep_first, keep_last = self.visible_page_range(self.release_margin)
+        for page_number in list(self.page_labels):
+            if page_number < keep_first or page_number > keep_last:
+                self.release_page_label(page_number)
+
+    def release_page_label(self, page_number):
+        """Remove the label of a page, if it has one."""
+        page_label = self.page_labels.pop(page_number, None)
+        if page_label is not None:
+            page_label.setParent(None)
+        self.displayed_keys.pop(page_number, None)
+        self.first_content_starts.pop(page_number, None)
+
+    def request_page_preview(self, page_number, visible):
+        """Show a quick low-resolution preview of a page that has nothing on display yet.
+
+        The page's sidebar thumbnail is used when it has been rendered; otherwise a
+        low-resolution render of a visible page is queued ahead of all sharp renders.
+        Returns the keys of the preview jobs still needed.
+        """
+        if page_number in self.thumbnail_pages:
+            icon = self.thumbnail_list_widget.item(page_number).icon()
+            self.show_page_preview(page_number, icon.pixmap(icon.availableSizes()[0]))
+            return set()
+        if not visible:
+            return set()
+        key = ('preview', self.pdf_document.name, page_number, self.page_rotations[page_number])
+        self.render_scheduler.submit(key, RenderScheduler.PREVIEW, pdf_engine.rasterize_page,
+                                     self.pdf_document.name, page_number, self.preview_zoom,
+                                     self.page_rotations[page_number])
+        return {key}
+
+    def show_page_preview(self, page_number, pixmap):
+        """Display a preview on a page label that has no sharp render yet."""
+        page_label = self.page_labels.get(page_number)
+        if page_label is not None and page_number in self.first_content_starts:
+            page_label.set_preview(pixmap)
+            self.note_first_content(page_number)
+
+    def note_first_content(self, page_number):
+        """Record how long a page label waited before showing anything."""
+        start = self.first_content_starts.get(page_number)
+        if start is not None:
+            self.first_content_latencies.append(time.perf_counter() - start)
+            self.perf.record('first content', self.first_content_latencies[-1], page=page_number)
+            if self.startup_clock is not None:
+                self.note_startup_step('first page')
+                self.report_startup()
+            if self.is_tiled(page_number):
+                # Tiled pages keep the preview under the tiles, so stop tracking here
+                del self.first_content_starts[page_number]
+
+    def is_tiled(self, page_number):
+        """Return whether a page is too large at the current zoom to render as one pixmap."""
+        size = self.page_sizes[page_number]
+        return size.width() * size.height() > self.tile_threshold
+
+    def update_page_tiles(self, page_number, priority):
+        """Show the tiles of a large page that fall in the extended viewport.
+
+        Tiles already in the tile cache are shown at once and the others are queued.
+        Tiles that left the extended viewport are dropped from the label, so the
+        memory held per page is bounded by the viewport size at any zoom. Returns
+        the keys of the tile jobs the page still needs.
+        """
+        page_label = self.page_labels[page_number]
+        viewport = self.scroll_area.viewport()
+        margin = int(self.prefetch_margin * viewport.height())
+        region = QRect(self.scroll_area.horizontalScrollBar().value(), self.scroll_area.verticalScrollBar().value(),
+                       viewport.width(), viewport.height())
+        region = region.adjusted(-self.tile_size, -margin, self.tile_size, margin)
+        region = region.intersected(page_label.geometry()).translated(-page_label.pos())
+
+        needed = set()
+        if not region.isEmpty():
+            for row in range(region.top() // self.tile_size, region.bottom() // self.tile_size + 1):
+                for column in range(region.left() // self.tile_size, region.right() // self.tile_size + 1):
+                    needed.add((column, row))
+        for tile in list(page_label.tiles):
+            if tile not in needed:
+                del page_label.tiles[tile]
+
+        wanted = set()
+        key = self.render_cache_key(page_number)
+        for column, row in needed:
+            tile_key = key + (column, row)
+            displayed = page_label.tiles.get((column, row))
+            if displayed is not None and displayed[0] == tile_key:
+                continue
+            pixmap = self.tile_cache.get(tile_key)
+            if pixmap is not None:
+                self.show_tile_pixmap(page_number, column, row, tile_key, pixmap)
+            else:
+                wanted.add(('tile',) + tile_key)
+                self.render_scheduler.submit(('tile',) + tile_key, priority, pdf_engine.rasterize_page,
+                                             self.pdf_document.name, page_number, self.zoom_factor,
+                                             self.page_rotations[page_number], self.tile_clip(column, row))
+        return wanted
+
+    def tile_clip(self, column, row):
+        """Return the page area, in page coordinates, covered by a tile at the current zoom."""
+        left = column * self.tile_size / self.zoom_factor
+        top = row * self.tile_size / self.zoom_factor
+        size = self.tile_size / self.zoom_factor
+        return fitz.Rect(left, top, left + size, top + size)
+
+    def show_tile_pixmap(self, page_number, column, row, key, pixmap):
+        """Display a rendered tile on the label of a page, if the page has one."""
+        page_label = self.page_labels.get(page_number)
+        if page_label is not None:
+            position = QPoint(column * self.tile_size, row * self.tile_size)
+            page_label.tiles[(column, row)] = (key, position, pixmap)
+            page_label.update(QRect(position, pixmap.size()))
+            self.note_first_content(page_number)
+
+    def render_cache_key(self, page_number):
+        """Return the render cache key of a page in its current state."""
+        return (self.pdf_document.name, page_number, round(self.zoom_factor, 4), self.page_rotations[page_number])
+
+    def request_page_render(self, page_number, priority):
+        """Show a page from the render cache, or queue its rasterization on the worker pool."""
+        key = self.render_cache_key(page_number)
+        pixmap = self.render_cache.get(key)
+        if pixmap is None and self.render_scheduler.executor is None and priority == RenderScheduler.VISIBLE:
+            # Until the workers are started a visible page is quicker to render right here
+            pixmap = self.render_page(page_number)
+        if pixmap is not None:
+            self.show_page_pixmap(page_number, key, pixmap)
+            return
+        self.render_scheduler.submit(('page',) + key, priority, pdf_engine.rasterize_page,
+                                     self.pdf_document.name, page_number, self.zoom_factor,
+                                     self.page_rotations[page_number])
+
+    def show_page_pixmap(self, page_number, key, pixmap):
+        """Display a rendered pixmap on the label of a page, if the page has one."""
+        page_label = self.page_labels.get(page_number)
+        if page_label is not None:
+            page_label.setPixmap(pixmap)
+            page_label.preview = None
+            self.displayed_keys[page_number] = key
+            self.note_first_content(page_number)
+            self.first_content_starts.pop(page_number, None)
+
+    def note_startup_step(self, name):
+        """Record how long a startup step took, while main() is timing the startup."""
+        if self.startup_clock is None:
+            return
+        now = time.perf_counter()
+        self.startup_timings[name] = now - self.startup_clock
+        self.startup_clock = now
+
+    def startup_summary(self):
+        """Return the startup timings as one line, e.g. "imports 310 ms, window 90 ms; 400 ms in total"."""
+        steps = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.startup_timings.items())
+        return f"{steps}; {sum(self.startup_timings.values()) * 1000:.0f} ms in total"
+
+    def report_startup(self):
+        """Stop timing the startup and print the breakdown."""
+        self.startup_clock = None
+        print(f"Startup: {self.startup_summary()}", file=sys.stderr)
+
+    def render_job_finished(self, key, result):
+        """Receive a rasterization result from the worker pool."""
+        kind = key[0]
+        # Splits, merges and OCR conversions write files and outlive the document they were started from
+        if kind == 'split':
+            self.split_parts_done(key[2], result)
+            return
+        if kind == 'merge':
+            self.merge_step_done(key[2], key[3], result)
+            return
+        if kind == 'ocr':
+            self.ocr_page_done(key[2], key[3], result)
+            return
+        if kind == 'open':
+            self.open_job_done(key[2], result)
+            return
+        if kind == 'print':
+            # The print job keeps going while another tab is shown
+            self.print_page_rendered(key[2], image_from_raster(result))
+            return
+        # Search indexes of documents in background tabs are kept for when they are shown again
+        if kind == 'search_index':
+            if result is None:
+                self.start_index_build(key[1], key[2])
+            else:
+                self.search_index_ready(key[1], key[2], result)
+            return
+        if kind == 'index_chunk':
+            self.index_chunk_done(key[1], key[2], key[3], result)
+            return
+        if not self.pdf_document or key[1] != self.pdf_document.name:
+            return
+        if kind == 'page':
+            page_number = key[2]
+            if key[1:] != self.render_cache_key(page_number):
+                return  # Rendered at a zoom or rotation that is no longer current
+            with self.perf.timed('pixmap conversion', page=page_number):
+                pixmap = QPixmap.fromImage(image_from_raster(result))
+            self.render_cache.put(key[1:], pixmap)
+            self.show_page_pixmap(page_number, key[1:], pixmap)
+        elif kind == 'tile':
+            page_number, column, row = key[2], key[-2], key[-1]
+            tile_key = key[1:]
+            if tile_key[:-2] != self.render_cache_key(page_number):
+                return
+            with self.perf.timed('pixmap conversion', page=page_number, tile=(column, row)):
+                pixmap = QPixmap.fromImage(image_from_raster(result))
+            self.tile_cache.put(tile_key, pixmap)
+            self.show_tile_pixmap(page_number, column, row, tile_key, pixmap)
+        elif kind == 'preview':
+            if key[3] == self.page_rotations[key[2]]:
+                self.show_page_preview(key[2], QPixmap.fromImage(image_from_raster(result)))
+        elif kind == 'thumbnail':
+            if key[3] == self.page_rotations[key[2]]:
+                pixmap = QPixmap()
+                pixmap.loadFromData(result, 'PNG')
+                self.show_thumbnail(key[2], pixmap)
+        elif kind == 'search_scan':
+            if key[2] == self.search_generation:
+                self.add_search_results(key[3], result)
+
+    def render_job_failed(self, key, message):
+        """Report a rasterization job that raised in a worker."""
+        if key[0] == 'print':
+            self.finish_print_job(f"An error occurred while printing the document: {message}")
+        elif key[0] == 'split':
+            if self.split_job is not None and self.split_job['number'] == key[2]:
+                self.finish_split_job(message)
+        elif key[0] == 'merge':
+            if self.merge_job is not None and self.merge_job['number'] == key[2]:
+                self.finish_merge_job(message)
+        elif key[0] == 'open':
+            if self.open_job is not None and self.open_job['number'] == key[2]:
+                self.finish_open_job(message)
+        elif key[0] in ('search_index', 'index_chunk'):
+            # One failed chunk fails the whole build
+            if self.index_builds.pop(key[1:3], None) is not None:
+                self.render_scheduler.cancel(lambda other: other[0] == 'index_chunk' and other[1:3] == key[1:3])
+            if self.search_status_label.text() == "Indexing...":
+                self.search_status_label.clear()
+            print(f"Building the search index failed: {message}", file=sys.stderr)
+        elif key[0] == 'ocr':
+            self.cancel_ocr_job(key[2])
+            QMessageBox.critical(self, "Error", f"An error occurred during the conversion: {message}")
+        elif key[0] == 'search_scan':
+            if key[2] == self.search_generation:
+                self.add_search_results(key[3], [])
+            print(f"Searching from page {key[3] + 1} failed: {message}", file=sys.stderr)
+        else:
+            print(f"Rendering page {key[2] + 1} failed: {message}", file=sys.stderr)
 
     def render_page(self, page_number, highlight_rects=None):
-        """Render a page as a QPixmap, with optional highlighted areas."""
-        page = self.pdf_document.load_page(page_number)
-        mat = fitz.Matrix(self.zoom_factor, self.zoom_factor)
-        pix = page.get_pixmap(matrix=mat)
-        image = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888 if pix.n == 3 else QImage.Format_RGBA8888)
+        """Render a page as a QPixmap, with optional highlighted areas.
+
+        Renders without highlighted areas are served from and stored in the render cache.
+        """
+        if not highlight_rects:
+            key = self.render_cache_key(page_number)
+            pixmap = self.render_cache.get(key)
+            if pixmap is None:
+                pixmap = self.rasterize_page(page_number)
+                self.render_cache.put(key, pixmap)
+            return pixmap
+        return self.rasterize_page(page_number, highlight_rects)
+
+    def rasterize_page(self, page_number, highlight_rects=None):
+        """Rasterize a page on the GUI thread and paint its highlighted areas on it."""
+        with self.perf.timed('gui rasterization', page=page_number):
+            page = self.pdf_document.load_page(page_number)
+            image = image_from_raster(pdf_engine.page_raster(page, self.zoom_factor))
 
         if highlight_rects:
             painter = QPainter(image)
@@ -319,34 +1519,272 @@ class PDFViewer(QMainWindow):
                 painter.drawRect(rect)
             painter.end()
 
-        # Draw annotations on the page
-        if page_number in self.annotations:
-            painter = QPainter(image)
-            for annotation in self.annotations[page_number]:
-                annotation_type, data = annotation
-                if annotation_type == 'highlight':
-                    painter.setPen(Qt.NoPen)
-                    painter.setBrush(QColor(255, 255, 0, 100))  # Yellow with transparency
-                    painter.drawRect(data)
-                elif annotation_type == 'rectangle':
-                    painter.setPen(QPen(QColor(0, 0, 255), 3, Qt.SolidLine))
-                    painter.setBrush(Qt.NoBrush)
-                    painter.drawRect(data)
-                elif annotation_type == 'text_note':
-                    painter.setPen(QPen(QColor(0, 0, 0)))
-                    painter.drawText(data['pos'], data['text'])
-            painter.end()
-
         return QPixmap.fromImage(image)
 
-    def render_thumbnail(self, page_number):
-        """Render a thumbnail for a specific page."""
-        page = self.pdf_document.load_page(page_number)
-        zoom = 0.2  # Thumbnail zoom factor (adjust for desired thumbnail size)
-        mat = fitz.Matrix(zoom, zoom)
-        pix = page.get_pixmap(matrix=mat)
-        image = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888 if pix.n == 3 else QImage.Format_RGBA8888)
-        return QPixmap.fromImage(image)
+    def set_render_cache_size(self):
+        """Ask for the render cache budget in megabytes."""
+        size_mb, ok = QInputDialog.getInt(self, "Render Cache Size", "Render cache budget (MB):",
+                                          self.render_cache.max_bytes // (1024 * 1024), 16, 65536)
+        if ok:
+            self.render_cache.set_max_bytes(size_mb * 1024 * 1024)
+
+    def show_render_cache_stats(self):
+        """Show the render cache hit/miss and eviction counters."""
+        stats = self.render_cache.stats()
+        tile_stats = self.tile_cache.stats()
+        latencies = self.first_content_latencies
+        first_content = (f"{statistics.median(latencies) * 1000:.0f} ms median, "
+                         f"{latencies[-1] * 1000:.0f} ms last" if latencies else "n/a")
+        QMessageBox.information(self, "Render Cache Statistics",
+                                f"Entries: {stats['entries']}\n"
+                                f"Memory: {stats['bytes'] / (1024 * 1024):.1f} MB of {stats['max_bytes'] / (1024 * 1024):.0f} MB\n"
+                                f"Hits: {stats['hits']}\n"
+                                f"Misses: {stats['misses']}\n"
+                                f"Hit rate: {stats['hit_rate']:.1%}\n"
+                                f"Evictions: {stats['evictions']}\n\n"
+                                f"Tiles: {tile_stats['entries']} "
+                                f"({tile_stats['bytes'] / (1024 * 1024):.1f} MB, hit rate {tile_stats['hit_rate']:.1%}, "
+                                f"{tile_stats['evictions']} evictions)\n\n"
+                                f"Time to first content: {first_content}" +
+                                (f"\nStartup: {self.startup_summary()}" if self.startup_timings else ""))
+
+    def toggle_perf_panel(self, checked):
+        """Show or hide the performance panel."""
+        self.perf_dock.setVisible(checked)
+
+    def perf_panel_visibility_changed(self, visible):
+        """Refresh the performance panel while it is shown, and only then."""
+        self.perf_panel_action.setChecked(visible)
+        if visible:
+            self.update_perf_panel()
+            self.perf_timer.start()
+        else:
+            self.perf_timer.stop()
+
+    def update_perf_panel(self):
+        """Show the latest timings, cache hit rates and memory use in the performance panel."""
+        lines = [f"{'Timing (ms)':<20} {'count':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}"]
+        for name, count, _, p50, p90, p99, longest in self.perf.summary():
+            lines.append(f"{name:<20} {count:>6} " + " ".join(f"{seconds * 1000:>8.1f}" for seconds in (p50, p90, p99, longest)))
+        lines.append("")
+        for name, cache in (("Pages", self.render_cache), ("Tiles", self.tile_cache)):
+            stats = cache.stats()
+            lines.append(f"{name + ' cache':<20} hit rate {stats['hit_rate']:.1%}, {stats['entries']} entries, "
+                         f"{stats['bytes'] / (1024 * 1024):.1f} of {stats['max_bytes'] / (1024 * 1024):.0f} MB")
+        counters = self.perf.counters
+        lines.append(f"{'Thumbnails':<20} {counters.get('thumbnail disk hits', 0)} from disk, "
+                     f"{counters.get('thumbnail renders', 0)} rendered")
+        scheduler = self.render_scheduler
+        lines.append(f"{'Render jobs':<20} {len(scheduler.running)} running, {len(scheduler.pending_jobs)} queued")
+        memory = pdf_engine.resident_memory()
+        lines.append(f"{'Resident memory':<20} " + (f"{memory / (1024 * 1024):.0f} MB" if memory is not None else "n/a"))
+        lines.append(f"{'Timing trace':<20} {self.perf.trace_path or 'off'}")
+        self.perf_label.setText("\n".join(lines))
+
+    def start_timing_trace(self):
+        """Append every timing from now on to a JSON Lines file chosen by the user."""
+        options = QFileDialog.Options()
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Timing Trace", "", "JSON Lines Files (*.jsonl);;All Files (*)", options=options)
+        if not file_path:
+            return
+        try:
+            self.perf.start_trace(file_path)
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"Could not write the timing trace: {e}")
+            return
+        if self.perf_dock.isVisible():
+            self.update_perf_panel()
+
+    def stop_timing_trace(self):
+        """Close the timing trace, if one is being written."""
+        self.perf.stop_trace()
+        if self.perf_dock.isVisible():
+            self.update_perf_panel()
+
+    def build_search_index(self):
+        """Start loading the search index of the open document from the cache in the background.
+
+        If it is not cached, start_index_build then builds it in chunks.
+        """
+        self.search_index = None
+        if self.pdf_document:
+            self.search_status_label.setText("Indexing...")
+            if (self.pdf_document.name, self.document_digest) in self.index_builds:
+                return
+            self.render_scheduler.submit(('search_index', self.pdf_document.name, self.document_digest),
+                                         RenderScheduler.BACKGROUND, pdf_engine.load_search_index, self.document_digest)
+
+    def start_index_build(self, path, digest):
+        """Index the pages of a document that has no cached index, one chunk per job."""
+        if (path, digest) in self.index_builds:
+            return
+        tab = next((tab for tab in self.documents if tab['path'] == path), None)
+        if tab is None:
+            return  # Closed while its index was looked up
+        if self.pdf_document and self.pdf_document.name == path:
+            page_count = len(self.pdf_document)
+        else:
+            page_count = len(tab['state']['page_rects'])
+        if not page_count:
+            # No chunk would ever finish the build, so the empty index is complete now
+            self.search_index_ready(path, digest, pdf_engine.SearchIndex())
+            return
+        self.index_builds[(path, digest)] = {
+            'index': pdf_engine.SearchIndex(),  # Pages indexed so far, in order
+            'chunks': {},  # First page -> index of the chunks done ahead of the merged pages
+            'page_count': page_count,
+        }
+        for first_page in range(0, page_count, self.index_chunk_pages):
+            last_page = min(first_page + self.index_chunk_pages, page_count) - 1
+            self.render_scheduler.submit(('index_chunk', path, digest, first_page), RenderScheduler.BACKGROUND,
+                                         pdf_engine.index_pages, path, first_page, last_page)
+
+    def index_chunk_done(self, path, digest, first_page, chunk):
+        """Append the chunks indexed so far to the search index in page order, and finish it after the last."""
+        build = self.index_builds.get((path, digest))
+        if build is None:
+            return
+        index = build['index']
+        build['chunks'][first_page] = chunk
+        while len(index.page_words) in build['chunks']:
+            index.extend(build['chunks'].pop(len(index.page_words)))
+        if len(index.page_words) < build['page_count']:
+            return
+        del self.index_builds[(path, digest)]
+        if digest:
+            try:
+                with self.perf.timed('search index save', pages=len(index.page_words)):
+                    index.save(pdf_engine.search_index_path(digest))
+            except OSError as e:
+                print(f"Saving the search index failed: {e}", file=sys.stderr)
+        self.search_index_ready(path, digest, index)
+
+    def search_index_ready(self, path, digest, index):
+        """Hand a finished search index to its document, whether it is on display or in a background tab."""
+        if self.pdf_document and self.pdf_document.name == path:
+            self.search_index = index
+            if self.search_status_label.text() == "Indexing...":
+                self.search_status_label.clear()
+            return
+        for tab in self.documents:
+            if tab['state'] is not None and tab['path'] == path and tab['state']['document_digest'] == digest:
+                tab['state']['search_index'] = index
+
+    def search_text(self):
+        """Search the document for the word or phrase in the search bar.
+
+        Queries are answered from the search index once it is built. Until then the
+        pages are scanned in chunks on the worker pool and the hits are shown as
+        they come in.
+        """
+        query = self.search_input.text().strip()
+        if not self.pdf_document or not query:
+            return
+        self.cancel_search_scan()
+        case_sensitive = self.match_case_checkbox.isChecked()
+        if self.search_index is not None:
+            self.set_search_results(self.search_index.search(query, case_sensitive))
+            if self.search_results:
+                self.go_to_search_result(0)
+            return
+
+        self.set_search_results([])
+        page_count = len(self.pdf_document)
+        for first_page in range(0, page_count, self.search_chunk_pages):
+            last_page = min(first_page + self.search_chunk_pages, page_count) - 1
+            self.render_scheduler.submit(('search_scan', self.pdf_document.name, self.search_generation, first_page),
+                                         RenderScheduler.SEARCH, pdf_engine.search_pages, self.pdf_document.name,
+                                         query, case_sensitive, first_page, last_page)
+            self.search_scan_pending += 1
+        self.update_search_status()
+
+    def cancel_search_scan(self):
+        """Stop the page scan of the previous query, if one is running."""
+        self.search_generation += 1
+        if self.search_scan_pending:
+            self.search_scan_pending = 0
+            self.render_scheduler.cancel(lambda key: key[0] == 'search_scan')
+            self.update_search_status()
+
+    def add_search_results(self, first_page, hits):
+        """Merge the hits of one scanned page chunk into the results, keeping them in page order."""
+        self.search_scan_pending -= 1
+        if hits:
+            position = bisect.bisect_left([hit_page for hit_page, _ in self.search_results], first_page)
+            self.search_results[position:position] = hits
+            if 0 <= position <= self.current_search_index:
+                self.current_search_index += len(hits)
+            self.update_search_highlights(hit_page for hit_page, _ in hits)
+            if self.current_search_index < 0:
+                self.go_to_search_result(0)
+        self.update_search_status()
+
+    def set_search_results(self, results):
+        """Replace the search hits and the highlights of the pages on screen."""
+        self.search_results = results
+        self.current_search_index = -1
+        self.update_search_status()
+        self.update_search_highlights(self.page_labels)
+
+    def update_search_status(self):
+        """Show the number of hits, the current one and whether pages are still being scanned."""
+        if self.current_search_index >= 0:
+            status = f"{self.current_search_index + 1} of {len(self.search_results)}"
+        else:
+            status = f"{len(self.search_results)} results"
+        if self.search_scan_pending:
+            status += " (searching...)"
+        self.search_status_label.setText(status)
+
+    def page_matrix(self, page_number):
+        """Return the matrix from unrotated page coordinates to pixels of the page's label."""
+        return self.pdf_document.load_page(page_number).rotation_matrix * fitz.Matrix(self.zoom_factor, self.zoom_factor)
+
+    def page_search_highlights(self, page_number):
+        """Return the search hits on a page as (pixel rect, is current) pairs at the current zoom."""
+        if not self.search_results:
+            return []
+        hits = [index for index, (hit_page, _) in enumerate(self.search_results) if hit_page == page_number]
+        if not hits:
+            return []
+        mat = self.page_matrix(page_number)
+        highlights = []
+        for index in hits:
+            for rect in self.search_results[index][1]:
+                irect = (fitz.Rect(rect) * mat).irect
+                highlights.append((QRect(irect.x0, irect.y0, irect.width, irect.height), index == self.current_search_index))
+        return highlights
+
+    def update_search_highlights(self, page_numbers):
+        """Refresh the search highlights of the given pages, if they are on screen."""
+        for page_number in set(page_numbers):
+            page_label = self.page_labels.get(page_number)
+            if page_label is not None:
+                page_label.overlay.set_highlights(self.page_search_highlights(page_number))
+
+    def go_to_search_result(self, index):
+        """Make one search hit current and scroll it into view."""
+        previous_page = self.search_results[self.current_search_index][0] if self.current_search_index >= 0 else None
+        self.current_search_index = index
+        page_number, rects = self.search_results[index]
+        self.update_search_status()
+
+        mat = self.pdf_document.load_page(page_number).rotation_matrix * fitz.Matrix(self.zoom_factor, self.zoom_factor)
+        top = (fitz.Rect(rects[0]) * mat).y0
+        viewport_height = self.scroll_area.viewport().height()
+        self.scroll_area.verticalScrollBar().setValue(int(self.page_offsets[page_number] + top - viewport_height / 3))
+        self.update_visible_pages()
+        self.update_search_highlights([page_number] if previous_page is None else [page_number, previous_page])
+
+    def next_search_result(self):
+        """Go to the next search hit, wrapping around at the end."""
+        if self.search_results:
+            self.go_to_search_result((self.current_search_index + 1) % len(self.search_results))
+
+    def prev_search_result(self):
+        """Go to the previous search hit, wrapping around at the start."""
+        if self.search_results:
+            self.go_to_search_result((self.current_search_index - 1) % len(self.search_results))
 
     def add_bookmark(self):
         """Add a bookmark for the current page."""
@@ -379,13 +1817,16 @@ class PDFViewer(QMainWindow):
                 self.scroll_area.verticalScrollBar().setValue(page_number)
                 QMessageBox.information(self, "Bookmark", f"Navigated to bookmark '{bookmark_name}' on page {page_number + 1}.")
 
-    def load_toc(self):
+    def load_toc(self, report_missing=True):
         """Load the Table of Contents (TOC) from the PDF."""
         if not self.pdf_document:
             return
         
-        toc = self.pdf_document.get_toc()  # Get the TOC as a list of tuples
-        if toc:
+        with self.perf.timed('toc load'):
+            toc = self.pdf_document.get_toc()  # Get the TOC as a list of tuples
+        if not toc and not report_missing:
+            self.toc_dock.setVisible(False)
+        elif toc:
             self.toc_list_widget.clear()
             for level, title, page in toc:
                 item_text = f"{'  ' * (level - 1)}{title}"
@@ -397,17 +1838,71 @@ class PDFViewer(QMainWindow):
             QMessageBox.information(self, "No Table of Contents", "This PDF does not contain a table of contents.")
 
     def load_thumbnails(self):
-        """Generate and display thumbnails for each page."""
+        """List every page in the thumbnail sidebar; thumbnails are rendered as items come into view."""
         if not self.pdf_document:
             return
 
         self.thumbnail_list_widget.clear()
+        self.thumbnail_pages.clear()
+        self.render_scheduler.cancel(lambda key: key[0] == 'thumbnail')
+        icon_size = self.thumbnail_list_widget.iconSize()
+        item_size = QSize(icon_size.width() + 80, icon_size.height() + 4)
         for page_number in range(len(self.pdf_document)):
-            thumbnail_pixmap = self.render_thumbnail(page_number)
-            item = QListWidgetItem(QIcon(thumbnail_pixmap), f"Page {page_number + 1}")
+            item = QListWidgetItem(f"Page {page_number + 1}")
             item.setData(Qt.UserRole, page_number)
+            item.setSizeHint(item_size)
             self.thumbnail_list_widget.addItem(item)
         self.thumbnail_dock.setVisible(True)
+        self.visible_thumbnails_timer.start()
+
+    def update_visible_thumbnails(self):
+        """Fill in the thumbnails of the sidebar items in view, from the disk cache or the worker pool."""
+        if not self.pdf_document or not self.thumbnail_dock.isVisible() or not self.thumbnail_list_widget.count():
+            self.render_scheduler.cancel(lambda key: key[0] == 'thumbnail')
+            return
+
+        viewport = self.thumbnail_list_widget.viewport()
+        last_row = self.thumbnail_list_widget.count() - 1
+        first = self.thumbnail_list_widget.indexAt(QPoint(0, 0)).row()
+        last = self.thumbnail_list_widget.indexAt(QPoint(0, viewport.height() - 1)).row()
+        first = max(0, (first if first >= 0 else 0) - self.thumbnail_prefetch)
+        last = min(last_row, (last if last >= 0 else last_row) + self.thumbnail_prefetch)
+
+        wanted = set()
+        for page_number in range(first, last + 1):
+            if page_number in self.thumbnail_pages:
+                continue
+            rotation = self.page_rotations[page_number]
+            png = self.thumbnail_disk_cache.get(self.document_digest, page_number, self.thumbnail_zoom, rotation)
+            if png is not None:
+                self.perf.count('thumbnail disk hits')
+                pixmap = QPixmap()
+                pixmap.loadFromData(png, 'PNG')
+                self.show_thumbnail(page_number, pixmap)
+                continue
+            key = ('thumbnail', self.pdf_document.name, page_number, rotation)
+            if key not in self.render_scheduler.pending_jobs and key not in self.render_scheduler.running:
+                self.perf.count('thumbnail renders')
+            wanted.add(key)
+            self.render_scheduler.submit(key, RenderScheduler.THUMBNAIL, pdf_engine.render_thumbnail,
+                                         self.pdf_document.name, page_number, self.thumbnail_zoom, rotation,
+                                         self.document_digest, self.thumbnail_disk_cache.directory)
+        self.render_scheduler.cancel(lambda key: key[0] == 'thumbnail' and key not in wanted)
+
+    def show_thumbnail(self, page_number, pixmap):
+        """Set the icon of a page's sidebar item."""
+        item = self.thumbnail_list_widget.item(page_number)
+        if item is not None:
+            item.setIcon(QIcon(pixmap))
+            self.thumbnail_pages.add(page_number)
+
+    def invalidate_thumbnail(self, page_number):
+        """Drop the thumbnail of a page whose appearance changed, rendering it again if in view."""
+        item = self.thumbnail_list_widget.item(page_number)
+        if item is not None:
+            item.setIcon(QIcon())
+        self.thumbnail_pages.discard(page_number)
+        self.visible_thumbnails_timer.start()
 
     def toc_item_clicked(self, item):
         """Navigate to the page corresponding to the clicked TOC item."""
@@ -421,9 +1916,8 @@ class PDFViewer(QMainWindow):
 
     def scroll_to_page(self, page_number):
         """Scroll to the specified page number."""
-        label = self.pages_layout.itemAt(page_number).widget()
-        if label:
-            self.scroll_area.ensureWidgetVisible(label)
+        if 0 <= page_number < len(self.page_offsets):
+            self.scroll_area.verticalScrollBar().setValue(self.page_offsets[page_number])
 
     def toggle_toc(self):
         """Toggle the visibility of the TOC dock."""
@@ -445,33 +1939,69 @@ class PDFViewer(QMainWindow):
         """Activate the text note annotation mode."""
         self.annotation_mode = 'text_note'
 
+    def activate_erase_mode(self):
+        """Activate the mode where clicking an annotation removes it."""
+        self.annotation_mode = 'erase'
+
     def page_mouse_press(self, event, page_number):
         """Handle mouse press events for annotations."""
         if self.annotation_mode == 'highlight' or self.annotation_mode == 'rectangle':
             self.current_annotation = QRect(event.pos(), event.pos())
         elif self.annotation_mode == 'text_note':
+            page_label = self.page_labels.get(page_number)
             text, ok = QInputDialog.getText(self, "Add Text Note", "Enter your note:")
-            if ok and text:
-                self.current_annotation = {'pos': event.pos(), 'text': text}
-                if page_number not in self.annotations:
-                    self.annotations[page_number] = []
-                self.annotations[page_number].append((self.annotation_mode, self.current_annotation))
-                self.display_all_pages()
+            if ok and text and page_label is not None:
+                overlay = page_label.overlay
+                rect = QRect(event.pos(), QFontMetrics(overlay.note_font()).boundingRect(text).size())
+                annotation_id = self.annotations.add(page_number, 'text_note', overlay.page_rect(rect), text)
+                self.edit_history.record(('annotations', range(annotation_id, annotation_id + 1)))
+                self.repaint_annotation(page_number, annotation_id)
+        elif self.annotation_mode == 'erase':
+            page_label = self.page_labels.get(page_number)
+            if page_label is not None:
+                x, y = page_label.overlay.page_point(event.pos())
+                # The grid finds the topmost annotation within a few pixels of the click
+                annotation_id = self.annotations.hit_test(page_number, x, y, self.erase_tolerance / self.zoom_factor)
+                if annotation_id is not None:
+                    self.repaint_annotation(page_number, annotation_id)
+                    self.annotations.remove(annotation_id)
+                    self.edit_history.record(('erased_annotations', range(annotation_id, annotation_id + 1)))
 
     def page_mouse_move(self, event, page_number):
         """Handle mouse move events for annotations."""
-        if self.annotation_mode and self.current_annotation and isinstance(self.current_annotation, QRect):
+        if self.annotation_mode and self.current_annotation is not None:
             self.current_annotation.setBottomRight(event.pos())
-            self.display_all_pages()
+            page_label = self.page_labels.get(page_number)
+            if page_label is not None:
+                page_label.overlay.set_rubber_band((self.annotation_mode, QRect(self.current_annotation)))
 
     def page_mouse_release(self, event, page_number):
         """Handle mouse release events for annotations."""
-        if self.annotation_mode and self.current_annotation:
-            if page_number not in self.annotations:
-                self.annotations[page_number] = []
-            self.annotations[page_number].append((self.annotation_mode, self.current_annotation))
+        if self.annotation_mode and self.current_annotation is not None:
+            page_label = self.page_labels.get(page_number)
+            if page_label is not None:
+                page_label.overlay.set_rubber_band(None)
+                page_rect = page_label.overlay.page_rect(self.current_annotation.normalized())
+                annotation_id = self.annotations.add(page_number, self.annotation_mode, page_rect)
+                self.edit_history.record(('annotations', range(annotation_id, annotation_id + 1)))
+                self.repaint_annotation(page_number, annotation_id)
             self.current_annotation = None
-            self.display_all_pages()
+
+    def repaint_annotation(self, page_number, annotation_id):
+        """Repaint the overlay region of a page covered by one annotation."""
+        page_label = self.page_labels.get(page_number)
+        if page_label is not None:
+            page_label.overlay.update_annotation(annotation_id)
+
+    def repaint_annotations(self, annotation_ids):
+        """Repaint the overlays showing any of the given annotations."""
+        if len(annotation_ids) == 1:
+            self.repaint_annotation(self.annotations.pages[annotation_ids[0]], annotation_ids[0])
+            return
+        for page_number in {self.annotations.pages[annotation_id] for annotation_id in annotation_ids}:
+            page_label = self.page_labels.get(page_number)
+            if page_label is not None:
+                page_label.overlay.update()
 
     def zoom_in(self):
         """Increase the zoom factor and redisplay all pages."""
@@ -495,96 +2025,257 @@ class PDFViewer(QMainWindow):
         self.scroll_area.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
 
     def export_annotations(self):
-        """Export the annotations to a JSON file."""
+        """Export the annotations to a JSON Lines file, one annotation per line in page coordinates."""
         if not self.annotations:
             QMessageBox.information(self, "No Annotations", "There are no annotations to export.")
             return
 
         options = QFileDialog.Options()
-        file_path, _ = QFileDialog.getSaveFileName(self, "Save Annotations", "", "JSON Files (*.json);;All Files (*)", options=options)
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Annotations", "", "JSON Lines Files (*.jsonl);;All Files (*)", options=options)
+        if file_path:
+            try:
+                count = pdf_engine.write_annotations(self.annotations, file_path)
+                QMessageBox.information(self, "Export Successful", f"{count} annotations exported successfully to {file_path}.")
+            except Exception as e:
+                QMessageBox.critical(self, "Error", f"An error occurred while exporting the annotations: {e}")
+
+    def import_annotations(self):
+        """Add the annotations of a JSON Lines file written by Export Annotations."""
+        if not self.pdf_document:
+            QMessageBox.warning(self, "No PDF Opened", "Please open a PDF file first.")
+            return
+
+        options = QFileDialog.Options()
+        file_path, _ = QFileDialog.getOpenFileName(self, "Import Annotations", "", "JSON Lines Files (*.jsonl);;All Files (*)", options=options)
         if file_path:
-            # Prepare annotations data for export
-            export_data = {}
-            for page_number, annots in self.annotations.items():
-                export_data[page_number] = []
-                for annotation_type, data in annots:
-                    if annotation_type == 'highlight' or annotation_type == 'rectangle':
-                        export_data[page_number].append({
-                            'type': annotation_type,
-                            'x': data.x(),
-                            'y': data.y(),
-                            'width': data.width(),
-                            'height': data.height()
-                        })
-                    elif annotation_type == 'text_note':
-                        export_data[page_number].append({
-                            'type': annotation_type,
-                            'pos': {'x': data['pos'].x(), 'y': data['pos'].y()},
-                            'text': data['text']
-                        })
-
-            # Write the annotations to a JSON file
-            with open(file_path, 'w') as json_file:
-                json.dump(export_data, json_file, indent=4)
-
-            QMessageBox.information(self, "Export Successful", f"Annotations exported successfully to {file_path}.")
+            try:
+                count = pdf_engine.read_annotations(self.annotations, file_path, self.pdf_document)
+            except Exception as e:
+                QMessageBox.critical(self, "Error", f"An error occurred while importing the annotations: {e}")
+                return
+            # The imported annotations got the newest ids, so one delta undoes them all
+            annotation_ids = range(len(self.annotations.pages) - count, len(self.annotations.pages))
+            if annotation_ids:
+                self.edit_history.record(('annotations', annotation_ids))
+            for page_label in self.page_labels.values():
+                page_label.overlay.update()
+            QMessageBox.information(self, "Import Successful", f"{count} annotations imported successfully.")
+
+    def embed_annotations(self):
+        """Write the annotations into the PDF as native annotations, all in one save."""
+        if not self.pdf_document:
+            QMessageBox.warning(self, "No PDF Opened", "Please open a PDF file first.")
+            return
+        if not self.annotations:
+            QMessageBox.information(self, "No Annotations", "There are no annotations to embed.")
+            return
+
+        try:
+            annotation_ids = [annotation_id for page_number in self.annotations.annotated_pages()
+                              for annotation_id in self.annotations.query(page_number)]
+            pages = self.edit_journal.embed_annotations(self.annotations, annotation_ids)
+            self.save_edits()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"An error occurred while embedding the annotations: {e}")
+            return
+
+        # The page renders now carry the annotations, so the overlay no longer draws them,
+        # and the deltas naming their ids are gone with them
+        self.annotations.clear()
+        self.edit_history.clear()
+        for page_number in pages:
+            self.render_cache.invalidate_page(self.pdf_document.name, page_number)
+            self.tile_cache.invalidate_page(self.pdf_document.name, page_number)
+            self.invalidate_thumbnail(page_number)
+        self.display_all_pages(changed_pages=pages)
+        QMessageBox.information(self, "Embed Successful", f"{len(annotation_ids)} annotations embedded in the PDF on {len(pages)} pages.")
 
     def split_pdf(self):
-        """Split the current PDF into parts based on user-defined page ranges."""
+        """Split the current PDF into parts based on a user-defined specification, writing the parts in parallel."""
         if not self.pdf_document:
             QMessageBox.warning(self, "No PDF Opened", "Please open a PDF file first.")
             return
+        if self.split_job is not None:
+            QMessageBox.warning(self, "Split PDF", "A split is already in progress.")
+            return
+        # The parts are copied from the file the edits are saved to, which must have every edit
+        self.save_edits()
 
         # Get the page ranges from the user
-        page_ranges, ok = QInputDialog.getText(self, "Split PDF", "Enter page ranges (e.g., 1-3, 5-7):")
-        if ok and page_ranges:
+        spec, ok = QInputDialog.getText(self, "Split PDF", "Enter page ranges (e.g., 1-3, 5-7, 9-), \"every N\" or \"bookmarks\":")
+        if ok and spec:
             try:
-                ranges = self.parse_page_ranges(page_ranges)
+                parts = pdf_engine.parse_page_spec(spec, len(self.pdf_document), self.pdf_document.get_toc(simple=True))
                 options = QFileDialog.Options()
                 output_dir = QFileDialog.getExistingDirectory(self, "Select Output Directory", options=options)
-
-                if output_dir:
-                    for idx, (start, end) in enumerate(ranges):
-                        output_path = f"{output_dir}/split_part_{idx + 1}.pdf"
-                        doc = fitz.open()
-                        for page_num in range(start, end + 1):
-                            doc.insert_pdf(self.pdf_document, from_page=page_num, to_page=page_num)
-                        doc.save(output_path)
-                        doc.close()
-
-                    QMessageBox.information(self, "Split Successful", f"PDF split successfully and saved in {output_dir}.")
+                if not output_dir:
+                    return
+                save_options = self.ask_save_options("Split PDF", 'fast')
+                if save_options is None:
+                    return
+                self.start_split_job(parts, output_dir, save_options)
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"An error occurred while splitting the PDF: {e}")
 
-    def parse_page_ranges(self, page_ranges):
-        """Parse the page ranges input by the user."""
-        ranges = []
-        for part in page_ranges.split(','):
-            start, end = map(int, part.split('-'))
-            ranges.append((start - 1, end - 1))  # Adjust for 0-based indexing
-        return ranges
+    def start_split_job(self, parts, output_dir, save_options):
+        """Write the parts of a split on the worker pool, one job per part."""
+        job_number = next(self.split_job_numbers)
+        progress = QProgressDialog("Splitting...", "Cancel", 0, len(parts), self)
+        progress.setWindowTitle("Split PDF")
+        progress.setMinimumDuration(500)
+        progress.canceled.connect(lambda: self.finish_split_job(abort=True))
+        self.split_job = {
+            'number': job_number,
+            'output_dir': output_dir,
+            'part_count': len(parts),
+            'done': 0,  # Parts written so far
+            'pages': 0,  # Pages written so far
+            'started': time.perf_counter(),
+            'progress': progress,
+        }
+        parts = [(first, last, os.path.join(output_dir, pdf_engine.part_file_name(index, title)))
+                 for index, (first, last, title) in enumerate(parts)]
+
+        # Small parts are batched so each job carries enough pages to outweigh its round trip
+        batch = []
+        for part in parts:
+            batch.append(part)
+            if sum(last - first + 1 for first, last, _ in batch) >= self.split_batch_pages or part is parts[-1]:
+                self.render_scheduler.submit(('split', self.pdf_document.name, job_number, part[2]), RenderScheduler.BACKGROUND,
+                                             pdf_engine.split_parts, self.edit_journal.path, batch, save_options)
+                batch = []
+
+    def split_parts_done(self, job_number, result):
+        """Count the parts written by a job and finish the split after the last one."""
+        job = self.split_job
+        if job is None or job['number'] != job_number:
+            return
+        parts, pages = result
+        job['done'] += parts
+        job['pages'] += pages
+        elapsed = time.perf_counter() - job['started']
+        job['progress'].setValue(job['done'])
+        job['progress'].setLabelText(f"Wrote {job['done']} of {job['part_count']} parts "
+                                     f"({job['pages'] / max(elapsed, 1e-6):.0f} pages/s)")
+        if job['done'] == job['part_count']:
+            self.finish_split_job()
+
+    def finish_split_job(self, error=None, abort=False):
+        """End the split in progress and report how it went."""
+        job = self.split_job
+        if job is None:
+            return
+        self.split_job = None
+        self.render_scheduler.cancel(lambda key: key[0] == 'split')
+        job['progress'].close()
+        if error:
+            QMessageBox.critical(self, "Error", f"An error occurred while splitting the PDF: {error}")
+        elif not abort:
+            elapsed = time.perf_counter() - job['started']
+            QMessageBox.information(self, "Split Successful",
+                                    f"PDF split successfully into {job['part_count']} parts and saved in {job['output_dir']}.\n"
+                                    f"{job['pages']} pages written in {elapsed:.1f} s "
+                                    f"({job['pages'] / max(elapsed, 1e-6):.0f} pages/s).")
 
     def merge_pdfs(self):
-        """Merge multiple PDFs into a single document."""
+        """Merge multiple PDFs into a single document, in batches on the worker pool."""
+        if self.merge_job is not None:
+            QMessageBox.warning(self, "Merge PDFs", "A merge is already in progress.")
+            return
+        # The open document may be one of the inputs
+        self.save_edits()
+
         options = QFileDialog.Options()
         files, _ = QFileDialog.getOpenFileNames(self, "Select PDFs to Merge", "", "PDF Files (*.pdf);;All Files (*)", options=options)
 
         if files:
+            output_path, _ = QFileDialog.getSaveFileName(self, "Save Merged PDF", "", "PDF Files (*.pdf);;All Files (*)", options=options)
+            if output_path:
+                # The smallest preset stores the fonts and images the inputs share only once
+                save_options = self.ask_save_options("Merge PDFs", 'smallest')
+                if save_options is not None:
+                    self.start_merge_job(files, output_path, save_options)
+
+    def ask_save_options(self, title, default):
+        """Ask for one of the save presets of pdf_engine; returns its save options, or None if cancelled."""
+        presets = {"Fast": 'fast', "Compact (garbage collection, compression)": 'compact',
+                   "Smallest (deduplicated resources, compression, cleanup)": 'smallest'}
+        names = list(presets)
+        name, ok = QInputDialog.getItem(self, title, "Save options:", names,
+                                        list(presets.values()).index(default), False)
+        return pdf_engine.SAVE_PRESETS[presets[name]] if ok else None
+
+    def start_merge_job(self, files, output_path, save_options):
+        """Merge files into output_path one batch at a time; each finished batch queues the next."""
+        job_number = next(self.merge_job_numbers)
+        progress = QProgressDialog("Merging...", "Cancel", 0, len(files) + 1, self)
+        progress.setWindowTitle("Merge PDFs")
+        progress.setMinimumDuration(500)
+        progress.canceled.connect(lambda: self.finish_merge_job(abort=True))
+        self.merge_job = {
+            'number': job_number,
+            'files': files,
+            'output_path': output_path,
+            'partial_path': output_path + '.partial',  # Batches merged so far
+            'save_options': save_options,
+            'next_file': 0,  # Index in files of the first input of the next batch
+            'pages': 0,  # Pages merged so far
+            'toc': [],
+            'started': time.perf_counter(),
+            'progress': progress,
+        }
+        self.request_merge_batch()
+
+    def request_merge_batch(self):
+        """Queue the next batch of the merge, or the final write once every input has been appended."""
+        job = self.merge_job
+        first = job['next_file']
+        if first < len(job['files']):
+            batch = job['files'][first:first + self.merge_batch_size]
+            self.render_scheduler.submit(('merge', job['output_path'], job['number'], first), RenderScheduler.BACKGROUND,
+                                         pdf_engine.append_merge_batch, job['partial_path'], batch, first == 0,
+                                         job['save_options'])
+        else:
+            job['progress'].setLabelText(f"Writing {job['pages']} pages...")
+            self.render_scheduler.submit(('merge', job['output_path'], job['number'], None), RenderScheduler.BACKGROUND,
+                                         pdf_engine.finish_merge, job['partial_path'], job['output_path'],
+                                         job['toc'], job['save_options'])
+
+    def merge_step_done(self, job_number, step, result):
+        """Record a finished batch and queue the next step, or report the finished merge."""
+        job = self.merge_job
+        if job is None or job['number'] != job_number:
+            return
+        if step is None:
+            self.finish_merge_job()
+            return
+        job['pages'], toc = result
+        job['toc'].extend(toc)
+        job['next_file'] = min(step + self.merge_batch_size, len(job['files']))
+        job['progress'].setValue(job['next_file'])
+        job['progress'].setLabelText(f"Merged {job['next_file']} of {len(job['files'])} files ({job['pages']} pages)")
+        self.request_merge_batch()
+
+    def finish_merge_job(self, error=None, abort=False):
+        """End the merge in progress, removing its partial output unless it completed, and report how it went."""
+        job = self.merge_job
+        if job is None:
+            return
+        self.merge_job = None
+        self.render_scheduler.cancel(lambda key: key[0] == 'merge')
+        job['progress'].close()
+        if error or abort:
             try:
-                output_path, _ = QFileDialog.getSaveFileName(self, "Save Merged PDF", "", "PDF Files (*.pdf);;All Files (*)", options=options)
-                if output_path:
-                    output_pdf = fitz.open()
-                    for file in files:
-                        doc = fitz.open(file)
-                        output_pdf.insert_pdf(doc)
-                        doc.close()
-
-                    output_pdf.save(output_path)
-                    output_pdf.close()
-
-                    QMessageBox.information(self, "Merge Successful", f"PDFs merged successfully into {output_path}.")
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"An error occurred while merging the PDFs: {e}")
+                os.remove(job['partial_path'])
+            except OSError:
+                pass
+        if error:
+            QMessageBox.critical(self, "Error", f"An error occurred while merging the PDFs: {error}")
+        elif not abort:
+            elapsed = time.perf_counter() - job['started']
+            QMessageBox.information(self, "Merge Successful",
+                                    f"{len(job['files'])} PDFs ({job['pages']} pages) merged successfully into "
+                                    f"{job['output_path']} in {elapsed:.1f} s.")
 
     def rotate_current_page(self):
         """Rotate the current page 90 degrees clockwise."""
@@ -593,10 +2284,7 @@ class PDFViewer(QMainWindow):
             return
 
         try:
-            # Rotate the current page
-            self.pdf_document.load_page(self.current_page).set_rotation(90)
-            self.pdf_document.saveIncr()  # Save the rotation incrementally
-            self.display_all_pages()
+            self.rotate_pages([self.current_page], 90)
             QMessageBox.information(self, "Rotate Successful", f"Page {self.current_page + 1} rotated successfully.")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"An error occurred while rotating the page: {e}")
@@ -608,14 +2296,83 @@ class PDFViewer(QMainWindow):
             return
 
         try:
-            for page_num in range(len(self.pdf_document)):
-                self.pdf_document.load_page(page_num).set_rotation(90)
-            self.pdf_document.saveIncr()  # Save the rotation incrementally
-            self.display_all_pages()
+            self.rotate_pages(range(len(self.pdf_document)), 90)
             QMessageBox.information(self, "Rotate Successful", "All pages rotated successfully.")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"An error occurred while rotating the pages: {e}")
 
+    def rotate_pages(self, page_numbers, angle, record=True):
+        """Turn pages by angle degrees clockwise in the edit journal and re-render only those pages.
+
+        With record the turn is added to the undo history.
+        """
+        if record:
+            pages = page_numbers if isinstance(page_numbers, range) else tuple(page_numbers)
+            self.edit_history.record(('rotation', pages, angle))
+        # Pages past the layout read so far only have an estimated rotation, so theirs is read from the document
+        rotations = {page_number: ((self.page_rotations[page_number] if page_number < self.layout_next_page
+                                    else self.pdf_document[page_number].rotation) + angle) % 360
+                     for page_number in page_numbers}
+        self.edit_journal.set_rotations(rotations)
+        for page_number, rotation in rotations.items():
+            if angle % 180:
+                rect = self.page_rects[page_number]
+                self.page_rects[page_number] = fitz.Rect(0, 0, rect.height, rect.width)
+            self.page_rotations[page_number] = rotation
+        for page_number in self.thumbnail_pages & set(rotations):
+            self.invalidate_thumbnail(page_number)
+        self.display_all_pages(changed_pages=rotations)
+        self.note_edit()
+
+    def note_edit(self):
+        """Schedule the save of the edit journal after an edit."""
+        self.edit_flush_timer.start(self.edit_flush_delay)
+        self.setWindowTitle("PDF Viewer *")
+
+    def save_edits(self):
+        """Write the edits in the journal to the file in one incremental save."""
+        self.edit_flush_timer.stop()
+        if self.edit_journal is None:
+            return
+        try:
+            if self.edit_journal.flush():
+                if self.edit_journal.path != self.pdf_document.name:
+                    self.use_saved_original()
+                else:
+                    self.document_digest = pdf_engine.file_digest(self.pdf_document.name)
+            if not self.edit_journal.pending():
+                self.setWindowTitle("PDF Viewer")
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"An error occurred while saving the document: {e}")
+
+    def use_saved_original(self):
+        """Show a repaired document from its original file, which its first save has rewritten whole.
+
+        The original is no longer damaged, so it replaces the repaired copy for
+        rendering, and later edits are saved to it incrementally.
+        """
+        copy = self.pdf_document
+        tab = self.documents[self.active_document]
+        kinds = ('page', 'tile', 'preview', 'thumbnail', 'search_index', 'index_chunk')
+        self.render_scheduler.cancel(lambda key: key[0] in kinds and key[1] == copy.name)
+        for build_key in [build_key for build_key in self.index_builds if build_key[0] == copy.name]:
+            del self.index_builds[build_key]
+        self.cancel_search_scan()
+        self.render_cache.invalidate_document(copy.name)
+        self.tile_cache.invalidate_document(copy.name)
+        self.document_handles.pop(tab['path'], None)
+        tab['path'] = tab['file']
+        self.pdf_document = fitz.open(tab['path'])
+        self.edit_journal = pdf_engine.EditJournal(self.pdf_document)
+        self.document_digest = pdf_engine.file_digest(tab['path'])
+        self.use_document_handle(tab)
+        self.tab_bar.setTabToolTip(self.active_document, tab['file'])
+        copy.close()
+        self.display_all_pages()
+        self.load_thumbnails()
+        if self.search_index is None:
+            self.build_search_index()
+
     def view_edit_metadata(self):
         """View and edit PDF metadata."""
         if not self.pdf_document:
@@ -651,53 +2408,154 @@ class PDFViewer(QMainWindow):
     def save_metadata(self, title, author, subject, keywords, dialog):
         """Save the edited metadata back to the PDF."""
         try:
-            # Set new metadata
-            self.pdf_document.set_metadata({
+            # Set new metadata; it is saved with the other pending edits
+            fields = {
                 'title': title,
                 'author': author,
                 'subject': subject,
                 'keywords': keywords
-            })
-            self.pdf_document.saveIncr()  # Save changes incrementally
+            }
+            metadata = self.pdf_document.metadata
+            previous = {name: metadata.get(name, '') for name in fields}
+            self.edit_journal.set_metadata(fields)
+            self.edit_history.record(('metadata', previous, fields))
+            self.note_edit()
             QMessageBox.information(self, "Save Successful", "Metadata updated successfully.")
             dialog.accept()
         except Exception as e:
             QMessageBox.critical(self, "Error", f"An error occurred while saving metadata: {e}")
 
     def print_pdf(self):
-        """Print the currently opened PDF."""
+        """Print the currently opened PDF, rasterizing each page at the printer's resolution on the worker pool."""
         if not self.pdf_document:
             QMessageBox.warning(self, "No PDF Opened", "Please open a PDF file first.")
             return
+        if self.print_job is not None:
+            QMessageBox.warning(self, "Printing", "A print job is already in progress.")
+            return
 
         try:
+            from PyQt5.QtPrintSupport import QPrinter, QPrintDialog, QAbstractPrintDialog  # Loaded on first use, most sessions never print
             printer = QPrinter(QPrinter.HighResolution)
             print_dialog = QPrintDialog(printer, self)
+            print_dialog.setMinMax(1, len(self.pdf_document))
+            print_dialog.setOption(QAbstractPrintDialog.PrintPageRange)
+            print_dialog.setOption(QAbstractPrintDialog.PrintCurrentPage)
 
             if print_dialog.exec_() == QPrintDialog.Accepted:
-                painter = QPainter(printer)
-
-                for page_num in range(len(self.pdf_document)):
-                    page = self.pdf_document.load_page(page_num)
-                    mat = fitz.Matrix(self.zoom_factor, self.zoom_factor)
-                    pix = page.get_pixmap(matrix=mat)
-                    image = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888 if pix.n == 3 else QImage.Format_RGBA8888)
-                    rect = painter.viewport()
-                    size = image.size()
-                    size.scale(rect.size(), Qt.KeepAspectRatio)
-
-                    painter.setViewport(rect.x(), rect.y(), size.width(), size.height())
-                    painter.setWindow(image.rect())
-                    painter.drawImage(0, 0, image)
-
-                    if page_num < len(self.pdf_document) - 1:
-                        printer.newPage()
-
-                painter.end()
-                QMessageBox.information(self, "Print Successful", "The document was printed successfully.")
+                if printer.printRange() == QPrinter.PageRange:
+                    pages = list(range(printer.fromPage() - 1, printer.toPage()))
+                elif printer.printRange() == QPrinter.CurrentPage:
+                    pages = [self.current_page]
+                else:
+                    pages = list(range(len(self.pdf_document)))
+
+                self.start_print_job(printer, pages)
         except Exception as e:
+            self.print_job = None
             QMessageBox.critical(self, "Error", f"An error occurred while printing the document: {e}")
 
+    def start_print_job(self, printer, pages):
+        """Print the given page numbers on a configured printer, one page rendered ahead on the worker pool."""
+        painter = QPainter(printer)
+        progress = QProgressDialog("Printing...", "Cancel", 0, len(pages), self)
+        progress.setWindowTitle("Print")
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(500)
+        progress.canceled.connect(lambda: self.finish_print_job(abort=True))
+        self.print_job = {
+            'printer': printer,
+            'painter': painter,
+            'area': painter.viewport(),  # Printable area in device pixels
+            'pages': pages,
+            'next_index': 0,  # Index in pages of the next page to hand to the painter
+            'images': {},  # Page rendered ahead of the painter, by page number
+            'progress': progress,
+            # The printed document, as it is now, so that the job is not affected by switching tabs
+            'path': self.pdf_document.name,
+            'page_rects': {},  # Page number -> actual rect of the printed pages
+            'page_rotations': {},  # Page number -> rotation of the printed pages
+        }
+        for page_num in pages:
+            if page_num < self.layout_next_page:
+                rect, rotation = self.page_rects[page_num], self.page_rotations[page_num]
+            else:
+                # Past the layout read so far, the size and rotation are only estimates
+                page = self.pdf_document[page_num]
+                rect, rotation = page.rect, page.rotation
+            self.print_job['page_rects'][page_num] = rect
+            self.print_job['page_rotations'][page_num] = rotation
+
+        # The workers render one page ahead of the painter, so at most two page images are held
+        for page_num in pages[:2]:
+            self.request_print_page(page_num)
+
+    def print_zoom(self, page_number):
+        """Zoom factor that fills the printable area at the printer's resolution, capped at max_print_dpi."""
+        job = self.print_job
+        rect = job['page_rects'][page_number]
+        area = job['area']
+        zoom = min(area.width() / rect.width, area.height() / rect.height)
+        return zoom * min(1.0, self.max_print_dpi / job['printer'].resolution())
+
+    def request_print_page(self, page_number):
+        """Queue the rasterization of one page of the print job."""
+        job = self.print_job
+        self.render_scheduler.submit(('print', job['path'], page_number), RenderScheduler.VISIBLE,
+                                     pdf_engine.rasterize_page, job['path'], page_number,
+                                     self.print_zoom(page_number), job['page_rotations'][page_number])
+
+    def print_page_rendered(self, page_number, image):
+        """Paint rendered pages on the printer in order and queue the page after next."""
+        job = self.print_job
+        if job is None:
+            return
+
+        try:
+            job['images'][page_number] = image
+            painter = job['painter']
+            pages = job['pages']
+            while self.print_job is job and job['next_index'] < len(pages) and pages[job['next_index']] in job['images']:
+                index = job['next_index']
+                image = job['images'].pop(pages[index])
+                ahead = index + 2
+                if ahead < len(pages):
+                    self.request_print_page(pages[ahead])
+
+                rect = job['area']
+                size = image.size()
+                size.scale(rect.size(), Qt.KeepAspectRatio)
+                painter.setViewport(rect.x(), rect.y(), size.width(), size.height())
+                painter.setWindow(image.rect())
+                painter.drawImage(0, 0, image)
+
+                if index < len(pages) - 1:
+                    job['printer'].newPage()
+                job['next_index'] += 1
+                job['progress'].setValue(job['next_index'])
+        except Exception as e:
+            self.finish_print_job(f"An error occurred while printing the document: {e}")
+            return
+
+        if self.print_job is job and job['next_index'] == len(job['pages']):
+            self.finish_print_job()
+
+    def finish_print_job(self, error=None, abort=False):
+        """End the print job in progress, discarding it if abort is set, and report how it went."""
+        job = self.print_job
+        if job is None:
+            return
+        self.print_job = None
+        self.render_scheduler.cancel(lambda key: key[0] == 'print')
+        if abort or error:
+            job['printer'].abort()
+        job['painter'].end()
+        job['progress'].close()
+        if error:
+            QMessageBox.critical(self, "Error", error)
+        elif not abort:
+            QMessageBox.information(self, "Print Successful", "The document was printed successfully.")
+
     def toggle_night_mode(self):
         """Toggle between Night Mode and Normal Mode."""
         if self.is_night_mode:
@@ -723,21 +2581,43 @@ class PDFViewer(QMainWindow):
 
         self.is_night_mode = not self.is_night_mode
 
+    def closeEvent(self, event):
+        """Save pending edits and stop the render workers when the window closes."""
+        self.save_edits()
+        self.render_scheduler.shutdown()
+        self.perf.stop_trace()
+        super().closeEvent(event)
+
     def undo(self):
         """Undo the last action."""
-        if self.undo_stack:
-            action = self.undo_stack.pop()
-            self.redo_stack.append(action)
-            # Implement undo logic based on the type of action
-            self.display_all_pages()
+        delta = self.edit_history.undo()
+        if delta is not None:
+            self.apply_delta(delta, revert=True)
 
     def redo(self):
         """Redo the last undone action."""
-        if self.redo_stack:
-            action = self.redo_stack.pop()
-            self.undo_stack.append(action)
-            # Implement redo logic based on the type of action
-            self.display_all_pages()
+        delta = self.edit_history.redo()
+        if delta is not None:
+            self.apply_delta(delta, revert=False)
+
+    def apply_delta(self, delta, revert):
+        """Apply or revert an edit delta of the undo history, redrawing only the pages it touches."""
+        kind = delta[0]
+        if kind in ('annotations', 'erased_annotations'):
+            annotation_ids = delta[1]
+            # Undoing an addition and redoing an erase both remove the annotations
+            remove = revert == (kind == 'annotations')
+            change = self.annotations.remove if remove else self.annotations.restore
+            for annotation_id in annotation_ids:
+                change(annotation_id)
+            self.repaint_annotations(annotation_ids)
+        elif kind == 'rotation':
+            _, page_numbers, angle = delta
+            self.rotate_pages(page_numbers, -angle if revert else angle, record=False)
+        elif kind == 'metadata':
+            _, previous, fields = delta
+            self.edit_journal.set_metadata(previous if revert else fields)
+            self.note_edit()
 
     def convert_pdf_to_odt(self):
         """Convert the currently open PDF to LibreOffice .odt format using OCR."""
@@ -747,43 +2627,108 @@ class PDFViewer(QMainWindow):
 
         odt_output_path, _ = QFileDialog.getSaveFileName(self, "Save as LibreOffice ODT", "", "LibreOffice ODT Files (*.odt);;All Files (*)")
         if odt_output_path:
-            try:
-                # Perform OCR on the currently open PDF
-                text = self.perform_ocr_on_open_pdf()
-                # Convert the extracted text to LibreOffice ODT format
-                self.save_text_as_odt(text, odt_output_path)
-                QMessageBox.information(self, "Conversion Successful", f"PDF converted to LibreOffice ODT successfully and saved at {odt_output_path}.")
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"An error occurred during the conversion: {e}")
-
-    def perform_ocr_on_open_pdf(self):
-        """Perform OCR on the currently open PDF and extract the text."""
-        text = ""
-        for page_num in range(len(self.pdf_document)):
-            page = self.pdf_document.load_page(page_num)
-            pix = page.get_pixmap()
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            text += pytesseract.image_to_string(img)
-        return text
-
-    def save_text_as_odt(self, text, odt_output_path):
-        """Save extracted text as an ODT file using unoconv."""
-        temp_txt_path = "temp_output.txt"
-        with open(temp_txt_path, "w", encoding="utf-8") as temp_file:
-            temp_file.write(text)
-
-        subprocess.run(['unoconv', '-f', 'odt', temp_txt_path])
+            if any(job['output_path'] == odt_output_path for job in self.ocr_jobs.values()):
+                QMessageBox.warning(self, "OCR", f"A conversion to {odt_output_path} is already in progress.")
+                return
+            # The workers read the pages from the file, which must have every rotation
+            self.save_edits()
+            self.start_ocr_job(odt_output_path)
+
+    def set_ocr_dpi(self):
+        """Ask for the resolution pages are rendered at for OCR."""
+        dpi, ok = QInputDialog.getInt(self, "OCR Resolution", "Render pages for OCR at (DPI):", self.ocr_dpi, 72, 1200)
+        if ok:
+            self.ocr_dpi = dpi
+
+    def start_ocr_job(self, odt_output_path):
+        """Extract the text of every page on the worker pool, writing it to the ODT file as pages complete."""
+        try:
+            writer = pdf_engine.OdtWriter(odt_output_path)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"An error occurred during the conversion: {e}")
+            return
 
-        generated_odt = temp_txt_path.replace(".txt", ".odt")
-        if os.path.exists(generated_odt):
-            os.rename(generated_odt, odt_output_path)
+        job_number = next(self.ocr_job_numbers)
+        page_count = len(self.pdf_document)
+        progress = QProgressDialog("Recognizing text...", "Cancel", 0, page_count, self)
+        progress.setWindowTitle("Convert PDF to LibreOffice")
+        progress.setMinimumDuration(0)
+        progress.canceled.connect(lambda: self.cancel_ocr_job(job_number))
+        self.ocr_jobs[job_number] = {
+            'document': self.pdf_document.name,
+            'output_path': odt_output_path,
+            'writer': writer,
+            'page_count': page_count,
+            'next_page': 0,  # Next page to write to the ODT file
+            'done': 0,  # Pages whose text has been extracted
+            'texts': {},  # Text of the pages finished ahead of next_page
+            'sources': {'text': 0, 'cache': 0, 'ocr': 0},  # Pages by where their text came from
+            'progress': progress,
+        }
+        for page_num in range(page_count):
+            self.render_scheduler.submit(('ocr', self.pdf_document.name, job_number, page_num), RenderScheduler.BACKGROUND,
+                                         pdf_engine.extract_page_text, self.edit_journal.path, page_num,
+                                         self.ocr_dpi, self.ocr_cache.directory)
+
+    def ocr_page_done(self, job_number, page_number, result):
+        """Write the pages extracted so far in page order and finish the conversion after the last one."""
+        job = self.ocr_jobs.get(job_number)
+        if job is None:
+            return
+        text, source = result
+        job['texts'][page_number] = text
+        job['sources'][source] += 1
+        job['done'] += 1
+        job['progress'].setValue(job['done'])
+        job['progress'].setLabelText(f"Processed {job['done']} of {job['page_count']} pages "
+                                     f"({job['sources']['text']} from the text layer, "
+                                     f"{job['sources']['cache']} from the OCR cache, {job['sources']['ocr']} OCR'd)")
+        try:
+            while job['next_page'] in job['texts']:
+                job['writer'].add_paragraph(job['texts'].pop(job['next_page']))
+                job['next_page'] += 1
+            if job['next_page'] < job['page_count']:
+                return
+            del self.ocr_jobs[job_number]
+            job['progress'].close()
+            job['writer'].close()
+            QMessageBox.information(self, "Conversion Successful", f"PDF converted to LibreOffice ODT successfully and saved at {job['output_path']}.")
+        except Exception as e:
+            self.cancel_ocr_job(job_number)
+            QMessageBox.critical(self, "Error", f"An error occurred during the conversion: {e}")
 
-        os.remove(temp_txt_path)
+    def cancel_ocr_job(self, job_number):
+        """Stop an OCR conversion in progress and remove its unfinished output."""
+        job = self.ocr_jobs.pop(job_number, None)
+        if job is None:
+            return
+        self.render_scheduler.cancel(lambda key: key[0] == 'ocr' and key[2] == job_number)
+        job['progress'].close()
+        job['writer'].close()
+        try:
+            os.remove(job['output_path'])
+        except OSError:
+            pass
 
 def main():
+    """Start the viewer, opening the PDF files named on the command line."""
+    imported = time.perf_counter()
     app = QApplication(sys.argv)
     viewer = PDFViewer()
+    viewer.startup_timings = {'imports': imported - STARTUP_STARTED}
+    viewer.startup_clock = imported
     viewer.show()
+    viewer.note_startup_step('window')
+    # Qt has taken its own options out of the arguments
+    paths = app.arguments()[1:]
+    for path in paths:
+        try:
+            viewer.load_pdf(path)
+        except Exception as e:
+            QMessageBox.critical(viewer, "Error", f"An error occurred while opening {path}: {e}")
+    if viewer.startup_clock is not None and (not paths or viewer.pdf_document is None):
+        # Nothing to show, so the startup ends with the window
+        viewer.report_startup()
     sys.exit(app.exec_())
 
 if __name__ == '__main__':
@@ -0,0 +1,38 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdf_engine
+
+
+def test_hit_test_returns_the_topmost_overlapping_annotation():
+    store = pdf_engine.AnnotationStore()
+    below = store.add(0, 'rectangle', (10, 10, 100, 100))
+    above = store.add(0, 'highlight', (50, 50, 150, 150))
+    assert store.hit_test(0, 20, 20) == below
+    assert store.hit_test(0, 75, 75) == above
+    assert store.hit_test(0, 125, 125) == above
+    store.remove(above)
+    assert store.hit_test(0, 75, 75) == below
+    store.restore(above)
+    assert store.hit_test(0, 75, 75) == above
+
+
+def test_hit_test_tolerance():
+    store = pdf_engine.AnnotationStore()
+    annotation_id = store.add(0, 'highlight', (10, 10, 20, 20))
+    assert store.hit_test(0, 23, 15) is None
+    assert store.hit_test(0, 23, 15, tolerance=2.9) is None
+    assert store.hit_test(0, 23, 15, tolerance=3) == annotation_id
+    # Diagonally off a corner, the tolerance applies on both axes
+    assert store.hit_test(0, 7, 7, tolerance=3) == annotation_id
+
+
+def test_hit_test_across_grid_cells_and_pages():
+    store = pdf_engine.AnnotationStore()
+    cell = pdf_engine.AnnotationStore.CELL
+    annotation_id = store.add(1, 'rectangle', (cell - 5, cell - 5, cell * 3, cell * 3))
+    assert store.hit_test(1, cell * 2.5, cell * 2.5) == annotation_id
+    assert store.hit_test(1, cell - 6, cell - 6, tolerance=0.5) is None
+    assert store.hit_test(0, cell * 2.5, cell * 2.5) is None